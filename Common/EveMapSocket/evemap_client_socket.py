@@ -46,6 +46,36 @@ class EveMapClientSocket(EveMapBaseSocket):
         if message.decode() == "1": return True
         if message.decode() == "0": return False
 
+    def insert_events_batch_command(self, events: list[Event]) -> list[str]:
+        event_list_json = json.dumps([event.to_dict_risk_is_int() for event in events]).encode()
+        self.send_command(event_list_json, MessageType.INSERT_EVENTS_BATCH, PacketType.REQUEST)
+        message, message_type, packet_type = self.recv_command()
+
+        if not (message_type == MessageType.INSERT_EVENTS_BATCH and packet_type == PacketType.REPLY):
+            return []
+
+        return json.loads(message.decode())
+
+    def promote_admin_events_command(self, db_ids: list[int]) -> list[int]:
+        self.send_command(json.dumps(db_ids).encode(), MessageType.PROMOTE_ADMIN_EVENTS, PacketType.REQUEST)
+        message, message_type, packet_type = self.recv_command()
+
+        if not (message_type == MessageType.PROMOTE_ADMIN_EVENTS and packet_type == PacketType.REPLY):
+            return []
+
+        return json.loads(message.decode())
+
+    def get_admin_changes_command(self, since: int = 0) -> dict:
+        # ADMIN_EVENTS changes after the cursor, or a snapshot of them when since is 0 or too old.
+        # An invalid cursor gets {"error": ...} back
+        self.send_command(str(since).encode(), MessageType.FETCH_ADMIN_CHANGES, PacketType.REQUEST)
+        message, message_type, packet_type = self.recv_command()
+
+        if not (message_type == MessageType.FETCH_ADMIN_CHANGES and packet_type == PacketType.REPLY):
+            return {}
+
+        return json.loads(message.decode())
+
     def delete__event_command(self, db_id: int) -> bool:
         self.send_command((str(db_id)).encode(), MessageType.DELETE_EVENT, PacketType.REQUEST)
         message, message_type, packet_type = self.recv_command()
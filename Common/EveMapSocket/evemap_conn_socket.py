@@ -1,11 +1,13 @@
 import json
 import socket
+from typing import Iterable
 
 from .evemap_base_socket import EveMapBaseSocket
 from Server.user import User
 from Common.packet_base.eve_packet import MessageType, PacketType
-from Server.event import Event
-from Server.eve_map_dal import EveMapDAL
+from Server.change_feed import change_feed_json
+from Server.event import Event, EventBatch
+from Server.eve_map_dal import EveMapDAL, InsertStatus
 from Server.mail import Mail
 
 
@@ -18,8 +20,10 @@ class EveMapConnSocket(EveMapBaseSocket):
         user_list_json = json.dumps([user.to_dict() for user in user_list]).encode()
         self.send_command(user_list_json, MessageType.FETCH_USERS, PacketType.REPLY)
 
-    def handle_event_command(self, event_list: list[Event]):
-        event_list_json = json.dumps([event.to_dict() for event in event_list]).encode()
+    def handle_event_command(self, batches: Iterable[EventBatch]):
+        # Accepts the DAL batch iterator, the reply is encoded straight from the columns
+        records = (record for batch in batches for record in batch.json_records())
+        event_list_json = ("[" + ", ".join(records) + "]").encode()
         self.send_command(event_list_json, MessageType.FETCH_EVENTS, PacketType.REPLY)
 
     def handle_insert_event_command(self, message: bytes):
@@ -36,6 +40,44 @@ class EveMapConnSocket(EveMapBaseSocket):
         else:
             self.send_command(b'0', MessageType.INSERT_ADMIN_EVENT, PacketType.REPLY)
 
+    def handle_insert_events_batch_command(self, message: bytes):
+        event_list_json = json.loads(message.decode())
+        statuses: list[InsertStatus] = [InsertStatus.INVALID] * len(event_list_json)
+        events: list[Event] = []
+        positions: list[int] = []
+
+        for position, event_json in enumerate(event_list_json):
+            try:
+                events.append(Event.from_dict(event_json))
+                positions.append(position)
+            except (KeyError, TypeError, ValueError) as e:
+                print(f"Skipping invalid event in batch: {e}")
+
+        for position, status in zip(positions, EveMapDAL.insert_events_batch('EVENTS', events)):
+            statuses[position] = status
+
+        reply = json.dumps([status.value for status in statuses]).encode()
+        self.send_command(reply, MessageType.INSERT_EVENTS_BATCH, PacketType.REPLY)
+
+    def handle_promote_admin_events_command(self, message: bytes):
+        # Request and reply are JSON lists of admin event ids, the reply holds the ids that were promoted
+        promoted = EveMapDAL.promote_admin_events([int(db_id) for db_id in json.loads(message.decode())])
+        self.send_command(json.dumps(promoted).encode(), MessageType.PROMOTE_ADMIN_EVENTS, PacketType.REPLY)
+
+    def handle_admin_changes_command(self, message: bytes):
+        # Request is the since cursor as text, the reply is the ADMIN_EVENTS change feed JSON
+        try:
+            since = int(message.decode() or 0)
+        except ValueError as e:
+            since = -1
+            print(f"Invalid admin changes cursor: {e}")
+        if since < 0:
+            # Answered instead of raised, so a bad request does not end the client's connection thread
+            reply = json.dumps({"error": "since must be a non-negative integer"}).encode()
+        else:
+            reply = "".join(change_feed_json('ADMIN_EVENTS', since)).encode()
+        self.send_command(reply, MessageType.FETCH_ADMIN_CHANGES, PacketType.REPLY)
+
     def handle_delete_event_command(self, message: bytes):
         if EveMapDAL.delete_event(int(message.decode())):
             self.send_command(b'1', MessageType.DELETE_EVENT, PacketType.REPLY)
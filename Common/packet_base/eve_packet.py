@@ -11,6 +11,9 @@ class MessageType(Enum):
     INSERT_ADMIN_EVENT = 5
     FETCH_EVENTS = 6
     FETCH_USERS = 7
+    INSERT_EVENTS_BATCH = 8
+    PROMOTE_ADMIN_EVENTS = 9
+    FETCH_ADMIN_CHANGES = 10
 
 
 class PacketType(Enum):
@@ -0,0 +1,34 @@
+import json
+from typing import Final, Iterator
+
+from Server.eve_map_dal import EveMapDAL
+
+CHANGES_PAGE_SIZE: Final[int] = 1_000
+
+
+def change_feed_json(table_name: str, since: int, limit: int = CHANGES_PAGE_SIZE) -> Iterator[str]:
+    """
+    The changes to the table after the since cursor, as JSON text chunks:
+    {"snapshot": false, "cursor": n, "more": bool, "changes": [...]} with insert / update / delete / expire records,
+    or {"snapshot": true, "cursor": n, "markers": [...]} with every current event when since is 0 or older than the log.
+    Clients pass the cursor back as since, upsert inserted and updated events by identity and drop the others.
+    """
+    # Read before the snapshot, changes it already contains are replayed next time and applying them twice is harmless
+    latest = EveMapDAL.get_latest_change_seq()
+    changes = EveMapDAL.get_changes(table_name, since, limit) if since > 0 else None
+
+    if changes is None:
+        yield f'{{"snapshot": true, "cursor": {latest}, "markers": ['
+        separator = ""
+        for batch in EveMapDAL.iter_event_batches(table_name):
+            if len(batch):
+                yield separator + ", ".join(batch.json_records())
+                separator = ", "
+        yield "]}"
+        return
+
+    more = len(changes) == limit
+    cursor = changes[-1].seq if more else max([latest, since] + [change.seq for change in changes[-1:]])
+    yield json.dumps(
+        {"snapshot": False, "cursor": cursor, "more": more, "changes": [change.to_dict() for change in changes]}
+    )
@@ -0,0 +1,274 @@
+import itertools
+import math
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Final, Iterator, Optional
+
+from Server.event import Event, EventChange, Risk
+from Server.storage_engine import BoundingBox, StorageEngine
+
+MAX_CLUSTER_ZOOM: Final[int] = 16  # From the next zoom on single markers are returned
+POINTS_ZOOM: Final[int] = MAX_CLUSTER_ZOOM + 1
+CELL_LEVEL_OFFSET: Final[int] = 2  # Cells are a quarter of a 256 px map tile wide, so 64 px on screen
+LEAF_LEVEL: Final[int] = MAX_CLUSTER_ZOOM + CELL_LEVEL_OFFSET
+MAX_CLUSTERS: Final[int] = 1_000  # Clusters plus points per response, coarser cells are used above it
+CHANGES_PAGE_SIZE: Final[int] = 1_000
+MAX_MERCATOR_LATITUDE: Final[float] = 85.0511
+
+
+@dataclass(slots=True)
+class GridCell:
+    count: int = 0
+    latitude_sum: float = 0.0
+    longitude_sum: float = 0.0
+    identity_sum: int = 0  # Is the identity of the only event when count is 1
+    risks: list[int] = field(default_factory=lambda: [0] * len(Risk))
+
+    def to_dict(self) -> dict:
+        return {
+            "latitude": self.latitude_sum / self.count,
+            "longitude": self.longitude_sum / self.count,
+            "count": self.count,
+            "risks": {risk.name: self.risks[risk.value] for risk in Risk},
+        }
+
+
+class ClusterIndex:
+    """
+    Event counts in a quadtree of Web Mercator grid cells, one grid per level from the whole world down to
+    LEAF_LEVEL, where every cell splits into four on the next level. Each cell keeps a count per risk and
+    coordinate sums for its centroid, so a viewport at any zoom is answered from about as many cells as
+    fit on the screen. The index follows the change log, inserts and deletes touch one cell per level.
+    """
+
+    def __init__(self, engine: StorageEngine, table_name: str = 'EVENTS'):
+        self.engine = engine
+        self.table_name = table_name
+        self._levels: list[dict[tuple[int, int], GridCell]] = [{} for _ in range(LEAF_LEVEL + 1)]
+        self._members: dict[tuple[int, int], set[int]] = {}  # Event identities per leaf cell
+        self._events: dict[int, Event] = {}
+        self._lock = threading.Lock()
+        self._version: Optional[int] = None
+        self._listeners: list[Callable[[Optional[Event]], None]] = []
+        self.cursor = 0
+
+        self.rebuilds = 0
+        self.changes_applied = 0
+
+    def add_listener(self, listener: Callable[[Optional[Event]], None]):
+        # Called with each event added or removed as the index follows the log, None after a rebuild
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    @staticmethod
+    def cell_of(latitude: float, longitude: float, level: int) -> tuple[int, int]:
+        # The Web Mercator tile at zoom level that holds the point
+        scale = 1 << level
+        latitude = math.radians(min(max(latitude, -MAX_MERCATOR_LATITUDE), MAX_MERCATOR_LATITUDE))
+        x = int((longitude + 180.0) / 360.0 * scale)
+        y = int((1.0 - math.asinh(math.tan(latitude)) / math.pi) / 2.0 * scale)
+        return min(max(x, 0), scale - 1), min(max(y, 0), scale - 1)
+
+    def _add(self, event: Event):
+        self._remove(event.identity)
+        self._events[event.identity] = event
+        risk = event.risk.value
+        x, y = self.cell_of(event.latitude, event.longitude, LEAF_LEVEL)
+        self._members.setdefault((x, y), set()).add(event.identity)
+        for level in range(LEAF_LEVEL, -1, -1):
+            cell = self._levels[level].setdefault((x, y), GridCell())
+            cell.count += 1
+            cell.latitude_sum += event.latitude
+            cell.longitude_sum += event.longitude
+            cell.identity_sum += event.identity
+            cell.risks[risk] += 1
+            x, y = x >> 1, y >> 1
+
+    def _remove(self, identity: int):
+        event = self._events.pop(identity, None)
+        if event is None:
+            return
+        risk = event.risk.value
+        x, y = self.cell_of(event.latitude, event.longitude, LEAF_LEVEL)
+        members = self._members[(x, y)]
+        members.discard(identity)
+        if not members:
+            del self._members[(x, y)]
+        for level in range(LEAF_LEVEL, -1, -1):
+            cells = self._levels[level]
+            cell = cells[(x, y)]
+            cell.count -= 1
+            if cell.count == 0:
+                del cells[(x, y)]
+            else:
+                cell.latitude_sum -= event.latitude
+                cell.longitude_sum -= event.longitude
+                cell.identity_sum -= identity
+                cell.risks[risk] -= 1
+            x, y = x >> 1, y >> 1
+
+    def _apply(self, change: EventChange):
+        previous = self._events.get(change.event.identity)
+        if change.op in ('insert', 'update'):
+            self._add(change.event)
+        else:
+            self._remove(change.event.identity)
+        for listener in self._listeners:
+            if previous is not None:
+                listener(previous)
+            if change.op in ('insert', 'update'):
+                listener(change.event)
+
+    def _rebuild(self):
+        # The cursor is read first, replaying changes the snapshot already holds leaves the index the same
+        self.cursor = self.engine.get_latest_change_seq()
+        self._levels = [{} for _ in range(LEAF_LEVEL + 1)]
+        self._members = {}
+        self._events = {}
+        for batch in self.engine.iter_event_batches(self.table_name):
+            for event in batch:
+                self._add(event)
+        self.rebuilds += 1
+        for listener in self._listeners:
+            listener(None)
+
+    def sync(self):
+        # Brings the index up to the last commit, a no-op while the table's data version is unchanged
+        version = self.engine.get_data_version(self.table_name)
+        if version == self._version:
+            return
+        with self._lock:
+            if version == self._version:
+                return
+            if self._version is None:
+                self._rebuild()
+            while True:
+                changes = self.engine.get_changes(self.table_name, self.cursor, CHANGES_PAGE_SIZE)
+                if changes is None:
+                    # The log was trimmed past the cursor
+                    self._rebuild()
+                    continue
+                for change in changes:
+                    self._apply(change)
+                self.changes_applied += len(changes)
+                if changes:
+                    self.cursor = changes[-1].seq
+                if len(changes) < CHANGES_PAGE_SIZE:
+                    break
+            self._version = version
+
+    def _iter_cells(self, level: int, bounding_box: Optional[BoundingBox]) -> Iterator[tuple[tuple[int, int], GridCell]]:
+        cells = self._levels[level]
+        if bounding_box is None:
+            yield from cells.items()
+            return
+        min_lat, max_lat, min_lon, max_lon = bounding_box
+        min_x, min_y = self.cell_of(max_lat, min_lon, level)
+        max_x, max_y = self.cell_of(min_lat, max_lon, level)
+        if (max_x - min_x + 1) * (max_y - min_y + 1) < len(cells):
+            for x in range(min_x, max_x + 1):
+                for y in range(min_y, max_y + 1):
+                    if (x, y) in cells:
+                        yield (x, y), cells[(x, y)]
+        else:
+            for (x, y), cell in cells.items():
+                if min_x <= x <= max_x and min_y <= y <= max_y:
+                    yield (x, y), cell
+
+    def _cells_in(self, level: int, bounding_box: Optional[BoundingBox]) -> Optional[list[GridCell]]:
+        # None as soon as there are more than MAX_CLUSTERS cells, so too fine levels are given up early
+        cells = list(itertools.islice(
+            (cell for _, cell in self._iter_cells(level, bounding_box)), MAX_CLUSTERS + 1
+        ))
+        return cells if len(cells) <= MAX_CLUSTERS else None
+
+    def _points_in(self, bounding_box: Optional[BoundingBox]) -> Optional[list[Event]]:
+        # None when there are more than MAX_CLUSTERS events
+        events = []
+        for position, _ in self._iter_cells(LEAF_LEVEL, bounding_box):
+            for identity in self._members[position]:
+                event = self._events[identity]
+                if bounding_box is not None:
+                    min_lat, max_lat, min_lon, max_lon = bounding_box
+                    if not (min_lat <= event.latitude <= max_lat and min_lon <= event.longitude <= max_lon):
+                        continue
+                events.append(event)
+            if len(events) > MAX_CLUSTERS:
+                return None
+        return sorted(events, key=lambda event: event.identity)
+
+    def query(self, zoom: int, bounding_box: Optional[BoundingBox] = None) -> dict:
+        """
+        Clusters and single events in the bounding box for a map at zoom. A cell holding one event is
+        returned as that event. From POINTS_ZOOM on every event is returned, unless there are more
+        than MAX_CLUSTERS of them. Coarser cells are used until at most MAX_CLUSTERS remain.
+        """
+        self.sync()
+        with self._lock:
+            if zoom >= POINTS_ZOOM:
+                points = self._points_in(bounding_box)
+                if points is not None:
+                    return {"level": LEAF_LEVEL, "clusters": [], "points": [event.to_dict_risk_is_int() for event in points]}
+
+            level = min(max(zoom, 0), MAX_CLUSTER_ZOOM) + CELL_LEVEL_OFFSET
+            cells = self._cells_in(level, bounding_box)
+            while cells is None:
+                # Level 0 is a single cell, so this always ends
+                level -= 1
+                cells = self._cells_in(level, bounding_box)
+
+            clusters, points = [], []
+            for cell in cells:
+                if cell.count == 1:
+                    points.append(self._events[cell.identity_sum].to_dict_risk_is_int())
+                else:
+                    clusters.append(cell.to_dict())
+            return {"level": level, "clusters": clusters, "points": points}
+
+    def tile(self, zoom: int, x: int, y: int) -> dict:
+        """
+        Clusters and single events in one slippy-map tile, cut from the same cells as query so tiles never overlap.
+        Below POINTS_ZOOM that is the 4 x 4 cells of the tile, from there on its events (or its leaf cells
+        when there are more than MAX_CLUSTERS of them).
+        """
+        self.sync()
+        with self._lock:
+            level = min(zoom + CELL_LEVEL_OFFSET, LEAF_LEVEL)
+            if zoom >= POINTS_ZOOM:
+                level = LEAF_LEVEL
+            shift = level - zoom
+            if shift >= 0:
+                positions = [
+                    ((x << shift) + dx, (y << shift) + dy) for dx in range(1 << shift) for dy in range(1 << shift)
+                ]
+            else:
+                # Tiles past the leaf level share one leaf cell
+                positions = [(x >> -shift, y >> -shift)]
+            cells = [(position, self._levels[level][position]) for position in positions if position in self._levels[level]]
+
+            if zoom >= POINTS_ZOOM:
+                events = [
+                    self._events[identity] for position, _ in cells for identity in self._members[position]
+                    if self.cell_of(self._events[identity].latitude, self._events[identity].longitude, zoom) == (x, y)
+                ]
+                if len(events) <= MAX_CLUSTERS:
+                    events.sort(key=lambda event: event.identity)
+                    return {"level": level, "clusters": [], "points": [event.to_dict_risk_is_int() for event in events]}
+
+            clusters, points = [], []
+            for _, cell in cells:
+                if cell.count == 1:
+                    points.append(self._events[cell.identity_sum].to_dict_risk_is_int())
+                else:
+                    clusters.append(cell.to_dict())
+            return {"level": level, "clusters": clusters, "points": points}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'events': len(self._events),
+                'cells': sum(len(cells) for cells in self._levels),
+                'cursor': self.cursor,
+                'rebuilds': self.rebuilds,
+                'changes_applied': self.changes_applied,
+            }
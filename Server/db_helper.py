@@ -1,11 +1,13 @@
+import itertools
 import os
+import re
 import sqlite3
+import sys
 
 # Import from the refactored eve_map_dal.py
-from eve_map_dal import DATABASE_FILENAME, EveMapDAL  # Import the single DAL and the database filename
-# Assuming event.py, user.py are in the same directory or accessible
-from event import Event, Risk
-from user import User
+from Server.eve_map_dal import DATABASE_FILENAME, EveMapDAL  # Import the single DAL and the database filename
+from Server.event import Event, Risk
+from Server.user import User
 
 
 # Mock function for get_location_from_coordinates.
@@ -271,6 +273,46 @@ def create_dummy_data_for_database():
     print(f"\nFinished inserting events: {admin_events_count} into ADMIN_EVENTS, {user_events_count} into EVENTS.")
 
 
+def is_table_scan(detail: str) -> bool:
+    # A SCAN step reads a whole table or index, except an R*Tree handed the bounding box constraints
+    if not detail.startswith("SCAN "):
+        return False
+    return re.fullmatch(r"SCAN \w+ VIRTUAL TABLE INDEX \d+:\S+", detail) is None
+
+
+def verify_query_plans() -> bool:
+    """
+    Checks with EXPLAIN QUERY PLAN that every filter combination supported by /api/all_markers
+    is answered through indexes, for the event table as well as the CITIES and REGIONS lookups.
+    'Unknown' covers the OR branch that also matches events with a pending location.
+    """
+    all_use_index = True
+    viewport = (32.0, 32.1, 34.7, 34.9)  # bbox of the map viewport queries
+    filter_values = list(
+        itertools.product(
+            (None, "Tel Aviv", "Unknown"), (None, "Center District", "Unknown"), (None, Risk.GOOD.value), (None, viewport)
+        )
+    )
+
+    for table_name in ("EVENTS", "ADMIN_EVENTS"):
+        for city, region, risk, bounding_box in filter_values:
+            if (city, region, risk, bounding_box) == (None, None, None, None):
+                continue  # The unfiltered fetch reads every row anyway
+
+            plan = EveMapDAL.explain_marker_query(
+                table_name, city=city, region=region, risk=risk, bounding_box=bounding_box
+            )
+            scans = [detail for detail in plan if is_table_scan(detail)]
+            if scans:
+                all_use_index = False
+            print(
+                f"  {'SCAN' if scans else 'OK  '} {table_name} city={city} region={region} risk={risk} "
+                f"bbox={bounding_box}: {scans or plan}"
+            )
+
+    return all_use_index
+
+
 # --- Main execution block ---
 if __name__ == "__main__":
     # This block allows you to run this script directly to populate the database.
@@ -321,4 +363,10 @@ if __name__ == "__main__":
     except Exception as e:
         print(f"\nAn error occurred during verification: {e}")
 
+    print("\nChecking query plans of the marker filters...")
+    if not verify_query_plans():
+        print("  Some marker filters fall back to a full table scan.")
+        sys.exit(1)
+    print("  All marker filters use an index.")
+
     print("\nHelper script finished.")
@@ -0,0 +1,102 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Final, Iterator
+
+BUSY_TIMEOUT_SECONDS: Final[float] = 30.0
+CACHED_STATEMENTS: Final[int] = 256  # Prepared statements kept per connection
+CACHE_SIZE_KIB: Final[int] = 16_384  # Page cache per connection (negative PRAGMA value means KiB)
+
+
+class ConnectionPool:
+    """
+    Keeps one open SQLite connection per thread instead of connecting and closing on every query.
+    The Flask request threads, the socket handler threads and the cleanup thread all share the same pool,
+    each using its own connection, while WAL journaling lets readers run alongside the single writer.
+    """
+
+    def __init__(self, database_filename: str):
+        self.database_filename = database_filename
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: list[tuple[threading.Thread, sqlite3.Connection]] = []
+        self._wal_enabled = False
+
+    def _open_connection(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(
+            self.database_filename,
+            timeout=BUSY_TIMEOUT_SECONDS,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            isolation_level=None,  # Transactions are opened explicitly by transaction()
+            check_same_thread=False,  # Only the owning thread uses it, close_all() may run elsewhere
+            cached_statements=CACHED_STATEMENTS,
+        )
+
+        with self._lock:
+            if not self._wal_enabled:
+                # The journal mode is stored in the database file, so it only has to be set once
+                connection.execute("PRAGMA journal_mode=WAL")
+                self._wal_enabled = True
+
+            self._close_dead_thread_connections()
+            self._connections.append((threading.current_thread(), connection))
+
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KIB}")
+        connection.execute("PRAGMA temp_store=MEMORY")
+        connection.execute("PRAGMA foreign_keys=ON")
+        return connection
+
+    def _close_dead_thread_connections(self):
+        # Socket handler threads come and go, so connections of finished threads are closed here
+        alive = []
+        for thread, connection in self._connections:
+            if thread.is_alive():
+                alive.append((thread, connection))
+            else:
+                connection.close()
+        self._connections = alive
+
+    def get_connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._open_connection()
+            self._local.connection = connection
+            self._local.transaction_depth = 0
+        return connection
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """
+        Runs the block inside a single write transaction on the calling thread's connection.
+        BEGIN IMMEDIATE takes the write lock up front, so concurrent writers wait on the busy timeout
+        instead of failing with "database is locked" when upgrading a read transaction.
+        Nested calls join the outermost transaction.
+        """
+        connection = self.get_connection()
+        if self._local.transaction_depth > 0:
+            self._local.transaction_depth += 1
+            try:
+                yield connection
+            finally:
+                self._local.transaction_depth -= 1
+            return
+
+        connection.execute("BEGIN IMMEDIATE")
+        self._local.transaction_depth = 1
+        try:
+            yield connection
+        except BaseException:
+            connection.rollback()
+            raise
+        else:
+            connection.commit()
+        finally:
+            self._local.transaction_depth = 0
+
+    def close_all(self):
+        with self._lock:
+            for _, connection in self._connections:
+                connection.close()
+            self._connections = []
+        self._local = threading.local()
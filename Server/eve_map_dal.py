@@ -1,104 +1,54 @@
-import math
-import sqlite3
-import threading
-import time
-from datetime import datetime, timedelta
-from typing import Final, Optional
-
-import schedule
-from Server.event import Event
+import os
+from concurrent.futures import Future
+from typing import Final, Iterator, Optional
+
+from dotenv import load_dotenv
+
+from Server.cluster_index import ClusterIndex
+from Server.event import Event, EventBatch, EventChange
+from Server.geo_batch import GeoBatch
 from Server.geo_utils import GeoUtils
+from Server.location_enricher import LocationEnricher
+from Server.marker_broadcaster import MarkerBroadcaster, MarkerFilter
+from Server.sqlite_storage import DATABASE_FILENAME
+from Server.storage_engine import FETCH_BATCH_SIZE, BoundingBox, InsertStatus, create_storage_engine
+from Server.tile_cache import TileCache
 from Server.user import User
+from Server.write_queue import WriteQueue
 
-DATABASE_FILENAME: Final[str] = 'evemap.db'
+load_dotenv()
 
+# "sqlite" (default) or "memory"
+STORAGE_ENGINE_NAME: Final[str] = os.getenv("EVEMAP_STORAGE_ENGINE", "sqlite")
+ENGINE = create_storage_engine(STORAGE_ENGINE_NAME)
 
-class EveMapDAL:
-    @staticmethod
-    def create_events_table(cursor):
-        event_table = """CREATE TABLE IF NOT EXISTS EVENTS (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    event_name TEXT,
-                    longitude REAL,
-                    latitude REAL,
-                    risk INT,
-                    region TEXT,
-                    city TEXT,
-                    created_at DATETIME
-                ); """
-        cursor.execute(event_table)
-
-    @staticmethod
-    def create_users_table(cursor):
-        user_table = """ CREATE TABLE IF NOT EXISTS USERS (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        name TEXT NOT NULL,
-                        mail_address TEXT UNIQUE,
-                        password_hash TEXT NOT NULL,
-                        home_long REAL,
-                        home_lat REAL
-                    ); """
-        cursor.execute(user_table)
-
-    @staticmethod
-    def create_admin_events_table(cursor):
-        event_table = """ CREATE TABLE IF NOT EXISTS ADMIN_EVENTS (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            event_name TEXT,
-                            longitude REAL,
-                            latitude REAL,
-                            risk INT,
-                            region TEXT,
-                            city TEXT,
-                            created_at DATETIME
-                        ); """
-        cursor.execute(event_table)
+# Inserts commit with a pending location that the enricher fills in, set to "0" to geocode before committing
+DEFER_GEOCODING: Final[bool] = os.getenv("EVEMAP_DEFER_GEOCODING", "1") != "0"
 
+# Every event insert and delete goes through the single writer thread
+WRITE_QUEUE = WriteQueue(ENGINE, defer_geocoding=DEFER_GEOCODING)
+ENRICHER = LocationEnricher(ENGINE, WRITE_QUEUE)
+BROADCASTER = MarkerBroadcaster(ENGINE)
+CLUSTER_INDEX = ClusterIndex(ENGINE)
+TILE_CACHE = TileCache(CLUSTER_INDEX)
+
+
+class EveMapDAL:
     @staticmethod
     def create_database():
-        connection = sqlite3.connect(DATABASE_FILENAME, detect_types=sqlite3.PARSE_DECLTYPES)
-        cursor = connection.cursor()
-
-        EveMapDAL.create_events_table(cursor)
-        EveMapDAL.create_users_table(cursor)
-        EveMapDAL.create_admin_events_table(cursor)
+        ENGINE.create_database()
 
-        connection.commit()
-        connection.close()
+    @staticmethod
+    def submit_events(table_name: str, events: list[Event]) -> Future:
+        # Queues the inserts without waiting, the future resolves to one InsertStatus per event once committed
+        return WRITE_QUEUE.insert_events(table_name, events)
 
     @staticmethod
     def insert_event_to_table(table_name: str, event: Event) -> bool:
-        if not (table_name.isalpha() or '_' in table_name):
-            return False
-
-        connection = sqlite3.connect(DATABASE_FILENAME, detect_types=sqlite3.PARSE_DECLTYPES)
-        cursor = connection.cursor()
-        region, city = GeoUtils.get_location_from_coordinates(event)
-
-        if (event.region, event.city) == ("Unknown", "Unknown"):
-            print(f"Warning: Could not fetch location info for event {event.event_name}")
-
-        print(
-            f"Inserting event: "
-            f"{event.event_name}, {event.longitude}, {event.latitude}, {event.risk}, {region}, {city}"
-        )
-
-        if EveMapDAL.similar_event_from_table(event, table_name):
+        status = EveMapDAL.submit_events(table_name, [event]).result()[0]
+        if status == InsertStatus.DUPLICATE:
             print("There is already a similar event")
-            return False
-
-        cursor.execute(
-            f"""
-            INSERT INTO {table_name} (event_name, longitude, latitude, risk, region, city, created_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """,
-            (event.event_name, event.longitude, event.latitude, event.risk.value, region, city, datetime.now()),
-        )
-
-        connection.commit()
-        connection.close()
-
-        return True
+        return status == InsertStatus.INSERTED
 
     @staticmethod
     def insert_event(event: Event) -> bool:
@@ -109,140 +59,144 @@ class EveMapDAL:
         return EveMapDAL.insert_event_to_table('ADMIN_EVENTS', event)
 
     @staticmethod
-    def insert_user(user: User):
-        conn = sqlite3.connect(DATABASE_FILENAME)
-        c = conn.cursor()
-
-        # Safely get coordinates
-        longitude, latitude = user.get_longitude_and_latitude()
-        c.execute(
-            '''
-            INSERT INTO USERS (name, mail_address, password_hash, home_long, home_lat)
-            VALUES (?, ?, ?, ?, ?)
-        ''',
-            (user.name, user.mail_address, user.password_hash, longitude, latitude),
-        )
+    def insert_events_batch(table_name: str, events: list[Event]) -> list[InsertStatus]:
+        return EveMapDAL.submit_events(table_name, events).result()
 
-        conn.commit()
-        conn.close()
-
-        return True
+    @staticmethod
+    def insert_user(user: User):
+        return ENGINE.insert_user(user)
 
     @staticmethod
     def get_user_by_email(email: str) -> Optional[User]:
-        conn = sqlite3.connect(DATABASE_FILENAME)
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT name, mail_address, password_hash, home_long, home_lat FROM USERS WHERE mail_address = ?", (email,)
-        )
-        row = cursor.fetchone()
-        conn.close()
-        if row:
-            name, email, password_hash, long, lat = row
-            return User(
-                name=name,
-                mail_address=email,
-                password=password_hash,
-                password_is_hashed=True,
-                home_address={"longitude": long, "latitude": lat},
-            )
-        return None
+        return ENGINE.get_user_by_email(email)
 
     @staticmethod
     def get_all_users() -> list[User]:
-        conn = sqlite3.connect(DATABASE_FILENAME)
-        cursor = conn.cursor()
-        cursor.execute("SELECT name, mail_address, password_hash, home_long, home_lat FROM USERS")
-        rows = cursor.fetchall()
-        conn.close()
+        return ENGINE.get_all_users()
+
+    @staticmethod
+    def cleanup_database() -> int:
+        # Expires everything past its TTL right away, the cleanup thread does the same on its own schedule
+        return ENGINE.cleanup_database()
+
+    @staticmethod
+    def start_cleanup_thread():
+        ENGINE.start_cleanup_thread()
+
+    @staticmethod
+    def start_location_enricher():
+        # Resolves events left pending by an earlier run, later inserts wake it up on their own
+        ENRICHER.notify()
 
-        users: list[User] = []
-        for row in rows:
-            name, email, password_hash, long, lat = row
-            row_data = {
-                'name': name,
-                'home_address': {"home_long": long, "home_lat": lat},
-                'mail_address': email,
-                'password': password_hash,
-            }
-            e = User.from_dict(row_data)
-            users.append(e)
+    @staticmethod
+    def get_stats() -> dict:
+        return {**ENGINE.get_stats(), 'write_queue': WRITE_QUEUE.stats(), 'location_enricher': ENRICHER.stats(),
+                'geocode_cache': GeoUtils.get_geocode_cache_stats(), 'geocoder': GeoUtils.get_geocoder_stats(),
+                'marker_broadcaster': BROADCASTER.stats(), 'cluster_index': CLUSTER_INDEX.stats(),
+                'tile_cache': TILE_CACHE.stats()}
 
-        return users
+    @staticmethod
+    def get_write_backlog() -> int:
+        # Writes waiting for the writer thread, grows when writers fall behind
+        return WRITE_QUEUE.backlog()
 
     @staticmethod
-    def cleanup_database():
-        connection = sqlite3.connect(DATABASE_FILENAME, detect_types=sqlite3.PARSE_DECLTYPES)
-        cursor = connection.cursor()
+    def get_latest_change_seq() -> int:
+        return ENGINE.get_latest_change_seq()
 
-        # Calculate the cutoff time
-        cutoff_time = datetime.now() - timedelta(minutes=10)
+    @staticmethod
+    def get_changes(table_name: str, since: int, limit: int) -> Optional[list[EventChange]]:
+        # None when the cursor is older than the change log, the caller has to start from a snapshot
+        return ENGINE.get_changes(table_name, since, limit)
 
-        # Delete rows older than the cutoff time
-        cursor.execute("DELETE FROM EVENTS WHERE created_at < ?", (cutoff_time,))
+    @staticmethod
+    def stream_marker_changes(marker_filter: MarkerFilter, last_seq: Optional[int] = None) -> Iterator[str]:
+        # Server-Sent Events body with the EVENTS changes that match the filter, as they commit
+        return BROADCASTER.stream(marker_filter, last_seq)
 
-        connection.commit()
-        connection.close()
+    @staticmethod
+    def get_marker_clusters(zoom: int, bounding_box: Optional[BoundingBox] = None) -> dict:
+        # EVENTS grouped into grid cells sized for the zoom level, single events where a cell holds one
+        return CLUSTER_INDEX.query(zoom, bounding_box)
 
     @staticmethod
-    def run_scheduler():
-        schedule.every(1).minutes.do(EveMapDAL.cleanup_database)
-        while True:
-            schedule.run_pending()
-            time.sleep(1)
+    def get_marker_tile(zoom: int, x: int, y: int) -> tuple[str, str]:
+        # (etag, JSON body) of one slippy-map tile of EVENTS, served from the tile cache
+        return TILE_CACHE.get(zoom, x, y)
 
     @staticmethod
-    def start_cleanup_thread():
-        cleanup_thread = threading.Thread(target=EveMapDAL.run_scheduler, daemon=True)
-        cleanup_thread.start()
-
-    @staticmethod
-    def fetch_all_coordinates_from_table(table_name: str, city=None, region=None, risk=None) -> list[Event]:
-        conn = sqlite3.connect(DATABASE_FILENAME)
-        cursor = conn.cursor()
-
-        # Modify the query to include the identity field
-        query = f"SELECT id, event_name, latitude, longitude, risk, city, region FROM {table_name} WHERE 1=1"
-        params = []
-
-        if city:
-            query += " AND city = ?"
-            params.append(city)
-
-        if region:
-            query += " AND region = ?"
-            params.append(region)
-
-        if risk:
-            query += " AND risk = ?"
-            params.append(risk)
-
-        try:
-            cursor.execute(query, params)
-            rows = cursor.fetchall()
-        except sqlite3.Error as e:
-            print(f"Error fetching events: {e}")
-            rows = []  # Return empty list on error
-        finally:
-            conn.close()
-
-        events = []
-        for row in rows:
-            try:
-                event = Event(
-                    identity=row[0],
-                    event_name=row[1],
-                    latitude=row[2],
-                    longitude=row[3],
-                    risk=row[4],
-                    city=row[5] if row[5] else "Unknown",
-                    region=row[6] if row[6] else "Unknown",
-                )
-                events.append(event)
-            except Exception as e:
-                print(f"Error processing row {row}: {e}")  # Catch errors during Event object creation
-
-        return events
+    def get_data_version(table_name: str) -> int:
+        # Changes whenever the table is written to
+        return ENGINE.get_data_version(table_name)
+
+    @staticmethod
+    def explain_marker_query(
+            table_name: str, city=None, region=None, risk=None, bounding_box: Optional[BoundingBox] = None
+    ) -> list[str]:
+        # Only the SQLite engine has query plans
+        return ENGINE.explain_marker_query(table_name, city, region, risk, bounding_box)
+
+    @staticmethod
+    def fetch_all_coordinates_from_table(
+            table_name: str, city=None, region=None, risk=None, bounding_box: Optional[BoundingBox] = None
+    ) -> EventBatch:
+        return ENGINE.fetch_all_coordinates_from_table(table_name, city, region, risk, bounding_box=bounding_box)
+
+    @staticmethod
+    def iter_event_batches(
+            table_name: str,
+            city=None,
+            region=None,
+            risk=None,
+            after_id: int = 0,
+            limit: Optional[int] = None,
+            batch_size: int = FETCH_BATCH_SIZE,
+            bounding_box: Optional[BoundingBox] = None,
+    ) -> Iterator[EventBatch]:
+        """
+        Yields the matching events in id order as batches of at most batch_size rows.
+        Memory does not grow with the table, after_id and limit select a single page.
+        bounding_box is (min_lat, max_lat, min_lon, max_lon) and is answered through the spatial index.
+        """
+        return ENGINE.iter_event_batches(
+            table_name, city, region, risk, after_id, limit, batch_size, bounding_box=bounding_box
+        )
+
+    @staticmethod
+    def iter_event_batches_within_radius(
+            table_name: str,
+            latitude: float,
+            longitude: float,
+            radius_meters: float,
+            city=None,
+            region=None,
+            risk=None,
+            after_id: int = 0,
+            limit: Optional[int] = None,
+            batch_size: int = FETCH_BATCH_SIZE,
+    ) -> Iterator[EventBatch]:
+        # The spatial index answers the box around the circle, the exact distance check drops the corners
+        bounding_box = GeoUtils.bounding_box(latitude, longitude, radius_meters)
+        remaining = limit
+        for batch in ENGINE.iter_event_batches(
+                table_name, city, region, risk, after_id, None, batch_size, bounding_box=bounding_box
+        ):
+            batch = batch.select(
+                GeoBatch.within_radius(latitude, longitude, batch.latitudes, batch.longitudes, radius_meters)
+            )
+            if remaining is not None:
+                batch = batch.select(slice(0, remaining))
+                remaining -= len(batch)
+            if len(batch) > 0:
+                yield batch
+            if remaining == 0:
+                return
+
+    @staticmethod
+    def iter_events(table_name: str, city=None, region=None, risk=None, **kwargs) -> Iterator[Event]:
+        # Same as iter_event_batches, one Event at a time
+        for batch in EveMapDAL.iter_event_batches(table_name, city, region, risk, **kwargs):
+            yield from batch
 
     @staticmethod
     def fetch_all_coordinates_from_events(city=None, region=None, risk=None):
@@ -254,38 +208,20 @@ class EveMapDAL:
 
     @staticmethod
     def get_unique_cities():
-        conn = sqlite3.connect(DATABASE_FILENAME)
-        cursor = conn.cursor()
-        cursor.execute("SELECT DISTINCT city FROM EVENTS WHERE city IS NOT NULL")
-        cities = [row[0] for row in cursor.fetchall()]
-        conn.close()
-        return cities
+        return [facet['name'] for facet in EveMapDAL.get_filter_facets()['cities']]
 
     @staticmethod
     def get_unique_regions():
-        conn = sqlite3.connect(DATABASE_FILENAME)
-        cursor = conn.cursor()
-        cursor.execute("SELECT DISTINCT region FROM EVENTS WHERE region IS NOT NULL")
-        regions = [row[0] for row in cursor.fetchall()]
-        conn.close()
-        return regions
+        return [facet['name'] for facet in EveMapDAL.get_filter_facets()['regions']]
+
+    @staticmethod
+    def get_filter_facets() -> dict[str, list[dict]]:
+        # Cities and regions that have events, with per-risk counts
+        return ENGINE.get_filter_facets()
 
     @staticmethod
     def delete_event_from_table(db_id: int, table_name: str) -> bool:
-        try:
-            with sqlite3.connect(DATABASE_FILENAME, detect_types=sqlite3.PARSE_DECLTYPES) as conn:
-                cursor = conn.cursor()
-                cursor.execute(f"DELETE FROM {table_name} WHERE id = ?", (db_id,))
-            if cursor.rowcount == 0:
-                print(f"Warning: No event found with id {db_id}. No rows deleted.")
-                return False
-            else:
-                print(f"Successfully deleted event with id {db_id}.")
-                return True
-
-        except sqlite3.Error as e:
-            print(f"Database error occurred: {e}")
-            return False
+        return WRITE_QUEUE.delete_event(table_name, db_id).result()
 
     @staticmethod
     def delete_event(db_id: int) -> bool:
@@ -296,80 +232,19 @@ class EveMapDAL:
         return EveMapDAL.delete_event_from_table(db_id, 'ADMIN_EVENTS')
 
     @staticmethod
-    def distance_between_events(event1: Event, event2: Event) -> float:
-        earth_radius = 6_371_000
-
-        lat1 = event1.latitude # Lateral coordinate of the first event.
-        long1 = event1.longitude # Horizontal coordinate of the first event.
-        lat2 = event2.latitude # Lateral coordinate of the second event.
-        long2 = event2.longitude # Horizontal coordinate of the second event.
+    def promote_admin_events(db_ids: list[int]) -> list[int]:
+        # Moves confirmed admin events into EVENTS in one transaction, no geocoding or similarity check
+        return WRITE_QUEUE.promote_admin_events(db_ids).result()
 
-        # Convert all coordinates from degrees to radians
-        lat1_rad = math.radians(lat1)
-        lon1_rad = math.radians(long1)
-        lat2_rad = math.radians(lat2)
-        lon2_rad = math.radians(long2)
-
-        # Compute the differences in coordinates
-        delta_lat = lat2_rad - lat1_rad
-        delta_lon = lon2_rad - lon1_rad
-
-        # Haversine formula
-        a = math.sin(delta_lat / 2) ** 2 + \
-            math.cos(lat1_rad) * math.cos(lat2_rad) * \
-            math.sin(delta_lon / 2) ** 2
-
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-
-        # Final distance in meters
-        distance = earth_radius * c
+    @staticmethod
+    def promote_admin_event(db_id: int) -> bool:
+        return bool(EveMapDAL.promote_admin_events([db_id]))
 
-        return distance #Returns the distance between the two events.
+    @staticmethod
+    def distance_between_events(event1: Event, event2: Event) -> float:
+        # Thin wrapper over the vectorized engine, batch callers should use GeoBatch directly
+        return GeoBatch.distance(event1.latitude, event1.longitude, event2.latitude, event2.longitude)
 
     @staticmethod
     def similar_event_from_table(event_to_check: Event, table_name: str) -> bool:
-        # Connect to the database
-        conn = sqlite3.connect(DATABASE_FILENAME)
-        cursor = conn.cursor()
-
-        # SQL query to fetch all relevant event data from the specified table
-        query = f"SELECT id, event_name, latitude, longitude, risk, city, region FROM {table_name} WHERE 1=1"
-
-        # Attempt to execute the query and fetch results
-        try:
-            cursor.execute(query)
-            rows = cursor.fetchall()
-        except sqlite3.Error as e:
-            print(f"Error fetching events: {e}")
-            rows = []  # Return empty list on error
-        finally:
-            conn.close() # Always close the connection
-
-        # Parse the fetched rows into Event objects
-        events = []
-        for row in rows:
-            try:
-                event = Event(
-                    identity=row[0],
-                    event_name=row[1],
-                    latitude=row[2],
-                    longitude=row[3],
-                    risk=row[4],
-                    city=row[5] if row[5] else "Unknown",
-                    region=row[6] if row[6] else "Unknown",
-                )
-                events.append(event)
-            except Exception as e:
-                print(f"Error processing row {row}: {e}")  # Catch errors during Event object creation
-
-        # Check for duplicate or similar event
-        for event in events:
-            if event == event_to_check:
-                return True
-
-            if (event.event_name == event_to_check.event_name and event.risk == event_to_check.risk and
-                    EveMapDAL.distance_between_events(event, event_to_check) < 100):
-                return True
-
-        # No similar event found
-        return False
+        return ENGINE.similar_event_from_table(event_to_check, table_name)
@@ -1,5 +1,9 @@
+import json
 from dataclasses import dataclass
 from enum import Enum
+from typing import Iterator
+
+import numpy as np
 
 
 class Risk(Enum):
@@ -8,7 +12,7 @@ class Risk(Enum):
     NEUTRAL = 2
 
 
-@dataclass
+@dataclass(slots=True)
 class Event:
     event_name: str
     longitude: float
@@ -75,3 +79,132 @@ class Event:
             region=data["region"],
             city=data["city"],
         )
+
+
+@dataclass(slots=True)
+class EventChange:
+    # One change-log record: the event as inserted or updated, or as it was when deleted or expired
+    seq: int
+    op: str  # 'insert', 'update', 'delete' or 'expire'
+    event: Event
+
+    def to_dict(self):
+        return {"seq": self.seq, "op": self.op, **self.event.to_dict_risk_is_int()}
+
+
+class EventBatch:
+    """
+    Columnar set of events: NumPy arrays for id, latitude, longitude and risk, and dictionary-encoded
+    name, city and region columns (an integer code per row into a list of distinct strings).
+    Serializes straight from the columns, Event objects are only created for callers that index or iterate.
+    """
+
+    def __init__(
+            self,
+            identities: np.ndarray,
+            latitudes: np.ndarray,
+            longitudes: np.ndarray,
+            risks: np.ndarray,
+            name_codes: np.ndarray,
+            names: list[str],
+            city_codes: np.ndarray,
+            cities: list[str],
+            region_codes: np.ndarray,
+            regions: list[str],
+    ):
+        self.identities = identities
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        self.risks = risks
+        self.name_codes = name_codes
+        self.names = names
+        self.city_codes = city_codes
+        self.cities = cities
+        self.region_codes = region_codes
+        self.regions = regions
+
+    @staticmethod
+    def _intern(values) -> tuple[np.ndarray, list[str]]:
+        codes: dict[str, int] = {}
+        column = np.fromiter((codes.setdefault(value, len(codes)) for value in values), dtype=np.int32)
+        return column, list(codes)
+
+    @classmethod
+    def from_rows(cls, rows) -> 'EventBatch':
+        # Rows laid out as: id, event_name, latitude, longitude, risk, city, region
+        columns = list(zip(*rows)) if rows else [()] * 7
+        name_codes, names = cls._intern(columns[1])
+        city_codes, cities = cls._intern(columns[5])
+        region_codes, regions = cls._intern(columns[6])
+        return cls(
+            identities=np.array(columns[0], dtype=np.int64),
+            latitudes=np.array(columns[2], dtype=np.float64),
+            longitudes=np.array(columns[3], dtype=np.float64),
+            risks=np.array(columns[4], dtype=np.int8),
+            name_codes=name_codes,
+            names=names,
+            city_codes=city_codes,
+            cities=cities,
+            region_codes=region_codes,
+            regions=regions,
+        )
+
+    @classmethod
+    def empty(cls) -> 'EventBatch':
+        return cls.from_rows([])
+
+    def __len__(self) -> int:
+        return len(self.identities)
+
+    def __getitem__(self, index: int) -> Event:
+        # A fresh Event per access, so callers can modify it without touching the batch
+        return Event(
+            identity=int(self.identities[index]),
+            event_name=self.names[self.name_codes[index]],
+            latitude=float(self.latitudes[index]),
+            longitude=float(self.longitudes[index]),
+            risk=Risk(int(self.risks[index])),
+            city=self.cities[self.city_codes[index]],
+            region=self.regions[self.region_codes[index]],
+        )
+
+    def __iter__(self) -> Iterator[Event]:
+        for index in range(len(self)):
+            yield self[index]
+
+    def select(self, mask: np.ndarray) -> 'EventBatch':
+        # Rows where the boolean mask (or index array) selects, sharing the string tables
+        return EventBatch(
+            self.identities[mask],
+            self.latitudes[mask],
+            self.longitudes[mask],
+            self.risks[mask],
+            self.name_codes[mask],
+            self.names,
+            self.city_codes[mask],
+            self.cities,
+            self.region_codes[mask],
+            self.regions,
+        )
+
+    def json_records(self) -> list[str]:
+        # One JSON object per row with the same keys as Event.to_dict, every distinct string is encoded once
+        names = [json.dumps(name) for name in self.names]
+        cities = [json.dumps(city) for city in self.cities]
+        regions = [json.dumps(region) for region in self.regions]
+        return [
+            f'{{"identity": {identity}, "event_name": {names[name]}, "longitude": {longitude!r}, '
+            f'"latitude": {latitude!r}, "risk": {risk}, "region": {regions[region]}, "city": {cities[city]}}}'
+            for identity, name, longitude, latitude, risk, region, city in zip(
+                self.identities.tolist(),
+                self.name_codes.tolist(),
+                self.longitudes.tolist(),
+                self.latitudes.tolist(),
+                self.risks.tolist(),
+                self.region_codes.tolist(),
+                self.city_codes.tolist(),
+            )
+        ]
+
+    def to_json(self) -> str:
+        return "[" + ", ".join(self.json_records()) + "]"
@@ -0,0 +1,179 @@
+import heapq
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Callable, Final, Optional
+
+from Server.db_pool import ConnectionPool
+from Server.event import Risk
+
+EXPIRATION_BATCH_SIZE: Final[int] = 500  # Rows deleted per write transaction
+BATCH_PAUSE_SECONDS: Final[float] = 0.01  # Gives waiting writers the lock between batches
+BATCH_HISTORY_SIZE: Final[int] = 100
+ERROR_RETRY_SECONDS: Final[int] = 30
+
+# Time to live per table and risk level, None keeps the events forever
+DEFAULT_TTLS: Final[dict[str, dict[Risk, Optional[timedelta]]]] = {
+    'EVENTS': {
+        Risk.DANGER: timedelta(minutes=10),
+        Risk.GOOD: timedelta(minutes=10),
+        Risk.NEUTRAL: timedelta(minutes=10),
+    },
+    'ADMIN_EVENTS': {
+        Risk.DANGER: timedelta(days=1),
+        Risk.GOOD: timedelta(days=1),
+        Risk.NEUTRAL: timedelta(days=1),
+    },
+}
+
+
+class ExpirationEngine:
+    """
+    Deletes expired events in bounded batches driven by the (risk, created_at) index.
+    Instead of polling, the thread sleeps until the earliest deadline in a min-heap holding
+    the next expiry of every (table, risk) pair, and inserts wake it when they bring a deadline closer.
+    """
+
+    def __init__(self, pool: ConnectionPool, ttls: dict[str, dict[Risk, Optional[timedelta]]] = DEFAULT_TTLS):
+        self.pool = pool
+        self.ttls = ttls
+        self._heap: list[tuple[datetime, str, int]] = []
+        self._scheduled: dict[tuple[str, int], datetime] = {}
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._listeners: list[Callable[[str, int], None]] = []
+
+        self.expired_counts: dict[str, int] = {table_name: 0 for table_name in ttls}
+        self.batch_history: deque[dict] = deque(maxlen=BATCH_HISTORY_SIZE)
+
+    def add_listener(self, listener: Callable[[str, int], None]):
+        # Called with (table_name, deleted_count) after every batch that removed rows
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def get_ttl(self, table_name: str, risk: Risk) -> Optional[timedelta]:
+        return self.ttls.get(table_name, {}).get(risk)
+
+    def start(self):
+        with self._condition:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, daemon=True)
+
+        for table_name, risk_ttls in self.ttls.items():
+            for risk in risk_ttls:
+                self._schedule_oldest(table_name, risk)
+        self._thread.start()
+
+    def schedule(self, table_name: str, risk_value: int, created_at: datetime):
+        # Called after an insert, only matters when it expires before whatever is already scheduled
+        ttl = self.get_ttl(table_name, Risk(risk_value))
+        if ttl is None:
+            return
+
+        self._push_deadline(table_name, risk_value, created_at + ttl)
+
+    def _push_deadline(self, table_name: str, risk_value: int, deadline: datetime):
+        key = (table_name, risk_value)
+        with self._condition:
+            current = self._scheduled.get(key)
+            if current is not None and current <= deadline:
+                return
+
+            self._scheduled[key] = deadline
+            heapq.heappush(self._heap, (deadline, table_name, risk_value))
+            if self._heap[0][0] == deadline:
+                self._condition.notify()
+
+    def _schedule_oldest(self, table_name: str, risk: Risk):
+        cursor = self.pool.get_connection().cursor()
+        cursor.execute(f"SELECT MIN(created_at) FROM {table_name} WHERE risk = ?", (risk.value,))
+        oldest = cursor.fetchone()[0]
+        if oldest is not None:
+            self.schedule(table_name, risk.value, datetime.fromisoformat(str(oldest)))
+
+    def _pop_due(self) -> list[tuple[str, Risk]]:
+        # Blocks until at least one deadline passed, then returns every due (table, risk) pair
+        with self._condition:
+            while True:
+                now = datetime.now()
+                due = []
+                while self._heap and self._heap[0][0] <= now:
+                    deadline, table_name, risk_value = heapq.heappop(self._heap)
+                    if self._scheduled.get((table_name, risk_value)) == deadline:  # Skip superseded entries
+                        del self._scheduled[(table_name, risk_value)]
+                        due.append((table_name, Risk(risk_value)))
+                if due:
+                    return due
+
+                timeout = (self._heap[0][0] - now).total_seconds() if self._heap else None
+                self._condition.wait(timeout)
+
+    def _run(self):
+        while True:
+            for table_name, risk in self._pop_due():
+                try:
+                    self.expire(table_name, risk)
+                    self._schedule_oldest(table_name, risk)
+                except Exception as e:
+                    print(f"Error expiring {risk.name} events from {table_name}: {e}")
+                    self._push_deadline(
+                        table_name, risk.value, datetime.now() + timedelta(seconds=ERROR_RETRY_SECONDS)
+                    )
+
+    def expire(self, table_name: str, risk: Risk) -> int:
+        ttl = self.get_ttl(table_name, risk)
+        if ttl is None:
+            return 0
+
+        cutoff_time = datetime.now() - ttl
+        total_deleted = 0
+        while True:
+            batch_start = time.perf_counter()
+            with self.pool.transaction() as connection:
+                last_change = connection.execute("SELECT COALESCE(MAX(seq), 0) FROM CHANGES").fetchone()[0]
+                cursor = connection.execute(
+                    f"""
+                    DELETE FROM {table_name} WHERE id IN (
+                        SELECT id FROM {table_name} WHERE risk = ? AND created_at < ?
+                        ORDER BY created_at LIMIT ?
+                    )
+                """,
+                    (risk.value, cutoff_time, EXPIRATION_BATCH_SIZE),
+                )
+                deleted = cursor.rowcount
+                if deleted > 0:
+                    # The delete trigger logged these as deletes, the write lock is held so they are the only new records
+                    connection.execute(
+                        "UPDATE CHANGES SET op = 'expire' WHERE seq > ? AND table_name = ?", (last_change, table_name)
+                    )
+            duration = time.perf_counter() - batch_start
+
+            if deleted > 0:
+                total_deleted += deleted
+                self.expired_counts[table_name] = self.expired_counts.get(table_name, 0) + deleted
+                self.batch_history.append(
+                    {'table': table_name, 'risk': risk.name, 'deleted': deleted, 'seconds': duration}
+                )
+                print(f"Expired {deleted} {risk.name} events from {table_name} in {duration * 1000:.1f} ms")
+                for listener in self._listeners:
+                    listener(table_name, deleted)
+
+            if deleted < EXPIRATION_BATCH_SIZE:
+                return total_deleted
+            time.sleep(BATCH_PAUSE_SECONDS)
+
+    def expire_all(self) -> int:
+        return sum(
+            self.expire(table_name, risk) for table_name, risk_ttls in self.ttls.items() for risk in risk_ttls
+        )
+
+    def stats(self) -> dict:
+        with self._condition:
+            next_deadline = self._heap[0][0].isoformat() if self._heap else None
+        return {
+            'expired': dict(self.expired_counts),
+            'next_expiry': next_deadline,
+            'recent_batches': list(self.batch_history),
+        }
@@ -0,0 +1,57 @@
+from typing import Final
+
+import numpy as np
+
+EARTH_RADIUS_METERS: Final[int] = 6_371_000
+
+
+class GeoBatch:
+    """
+    Vectorized haversine computations over coordinate arrays.
+    Comparing one point against many stored points is a single NumPy pass instead of a Python loop.
+    """
+
+    @staticmethod
+    def distances(latitude: float, longitude: float, latitudes, longitudes) -> np.ndarray:
+        # Distance in meters from one point to every point in the arrays
+        lat1 = np.radians(latitude)
+        lon1 = np.radians(longitude)
+        lat2 = np.radians(np.asarray(latitudes, dtype=np.float64))
+        lon2 = np.radians(np.asarray(longitudes, dtype=np.float64))
+
+        # Haversine formula
+        a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+        return 2 * EARTH_RADIUS_METERS * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    @staticmethod
+    def pairwise_distances(latitudes_a, longitudes_a, latitudes_b, longitudes_b) -> np.ndarray:
+        # Matrix of distances in meters, row i holds the distances from point i of A to every point of B
+        lat1 = np.radians(np.asarray(latitudes_a, dtype=np.float64))[:, np.newaxis]
+        lon1 = np.radians(np.asarray(longitudes_a, dtype=np.float64))[:, np.newaxis]
+        lat2 = np.radians(np.asarray(latitudes_b, dtype=np.float64))[np.newaxis, :]
+        lon2 = np.radians(np.asarray(longitudes_b, dtype=np.float64))[np.newaxis, :]
+
+        a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+        return 2 * EARTH_RADIUS_METERS * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    @staticmethod
+    def nearest_neighbours(
+            latitudes_a, longitudes_a, latitudes_b, longitudes_b, count: int = 1
+    ) -> tuple[np.ndarray, np.ndarray]:
+        # Indexes into B and distances in meters of the count nearest points of B to each point of A, nearest first.
+        # argpartition selects them without sorting the whole row, only the selected columns are sorted
+        pairwise = GeoBatch.pairwise_distances(latitudes_a, longitudes_a, latitudes_b, longitudes_b)
+        count = min(count, pairwise.shape[1])
+        indexes = np.argpartition(pairwise, count - 1, axis=1)[:, :count]
+        nearest = np.take_along_axis(pairwise, indexes, axis=1)
+        order = np.argsort(nearest, axis=1)
+        return np.take_along_axis(indexes, order, axis=1), np.take_along_axis(nearest, order, axis=1)
+
+    @staticmethod
+    def within_radius(latitude: float, longitude: float, latitudes, longitudes, radius_meters: float) -> np.ndarray:
+        # Boolean mask of the points closer than the radius
+        return GeoBatch.distances(latitude, longitude, latitudes, longitudes) < radius_meters
+
+    @staticmethod
+    def distance(latitude1: float, longitude1: float, latitude2: float, longitude2: float) -> float:
+        return float(GeoBatch.distances(latitude1, longitude1, [latitude2], [longitude2])[0])
@@ -1,14 +1,71 @@
+import json
+import math
+import os
+from typing import Final, Optional
+
+from dotenv import load_dotenv
+
 from Server.event import Event
+from Server.geocode_cache import FORWARD_GEOCODE_CACHE, REVERSE_GEOCODE_CACHE, ForwardGeocodeCache, ReverseGeocodeCache
+from Server.geocoder_limits import SingleFlight, TokenBucket
+from Server.offline_geocoder import UNKNOWN, OfflineGeocoder
 from geopy.geocoders import Nominatim
 
+load_dotenv()
+
+METERS_PER_DEGREE_LATITUDE: Final[float] = 111_320.0
+GEOLOCATOR: Final[Nominatim] = Nominatim(user_agent="my_geopy_app")
+GEOCODER_REQUESTS_PER_SECOND: Final[float] = 1.0  # Nominatim usage policy allows one request per second
+GEOCODE_COUNTRY: Final[str] = "Israel"  # Appended to home addresses, the map only covers Israel
+BOUNDARIES_FILE: Final[str] = os.getenv("EVEMAP_BOUNDARIES_FILE", "")  # GeoJSON districts and cities, empty for online only
+
+# Shared by every thread that geocodes: identical concurrent lookups share one request,
+# and all requests to the provider are paced together
+REVERSE_LOOKUPS: Final[SingleFlight] = SingleFlight()
+FORWARD_LOOKUPS: Final[SingleFlight] = SingleFlight()
+PROVIDER_LIMITER: Final[TokenBucket] = TokenBucket(GEOCODER_REQUESTS_PER_SECOND)
+
+
+def load_offline_geocoder(path: str) -> Optional[OfflineGeocoder]:
+    # None without a readable boundaries file, lookups then only go to Nominatim.
+    # A file that parses but does not match the schema raises, so it fails at startup
+    if not path:
+        return None
+    try:
+        offline_geocoder = OfflineGeocoder.from_geojson(path)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Error loading boundaries from {path}: {e}")
+        return None
+    print(f"Loaded {len(offline_geocoder.polygons)} boundary polygons from {path}")
+    return offline_geocoder
+
+
+OFFLINE_GEOCODER: Final[Optional[OfflineGeocoder]] = load_offline_geocoder(BOUNDARIES_FILE)
+
 
 class GeoUtils:
     @staticmethod
     def get_location_from_coordinates(event: Event) -> tuple[str, str]:
-        geolocator = Nominatim(user_agent="my_geopy_app")
+        # Local boundaries answer without the network, points outside them fall back to Nominatim
+        if OFFLINE_GEOCODER is not None:
+            region, city = OFFLINE_GEOCODER.locate(event.latitude, event.longitude)
+            if UNKNOWN not in (region, city):
+                return region, city
 
+        # Nearby events share a cached answer, Nominatim is only asked about new or stale spots.
+        # Reports arriving together for the same spot wait for the first one's lookup
+        return REVERSE_LOOKUPS.do(
+            ReverseGeocodeCache.key(event.latitude, event.longitude),
+            lambda: REVERSE_GEOCODE_CACHE.get_or_fetch(
+                event.latitude, event.longitude, lambda: GeoUtils.reverse_geocode(event)
+            ),
+        )
+
+    @staticmethod
+    def reverse_geocode(event: Event) -> tuple[str, str]:
+        PROVIDER_LIMITER.acquire()
         # Pass coordinates as a tuple
-        location = geolocator.reverse((event.latitude, event.longitude))
+        location = GEOLOCATOR.reverse((event.latitude, event.longitude))
 
         if location and 'address' in location.raw:
             address = location.raw['address']
@@ -28,3 +85,43 @@ class GeoUtils:
 
         print(f"Warning: Could not fetch location info for event {event.event_name}")
         return "Unknown", "Unknown"
+
+    @staticmethod
+    def get_coordinates_from_address(street: str, city: str, state: str) -> tuple[Optional[float], Optional[float]]:
+        # Returns (latitude, longitude), (None, None) when the address is not found.
+        # Spellings of the same address share one normalized cache entry and one in-flight lookup
+        key = ForwardGeocodeCache.key(street, city, state)
+        return FORWARD_LOOKUPS.do(
+            key,
+            lambda: FORWARD_GEOCODE_CACHE.get_or_fetch(
+                key, lambda: GeoUtils.forward_geocode(f"{street}, {city}, {state}, {GEOCODE_COUNTRY}")
+            ),
+        )
+
+    @staticmethod
+    def forward_geocode(address: str) -> tuple[Optional[float], Optional[float]]:
+        PROVIDER_LIMITER.acquire()
+        location = GEOLOCATOR.geocode(address)
+        if location:
+            return location.latitude, location.longitude
+        return None, None
+
+    @staticmethod
+    def bounding_box(latitude: float, longitude: float, radius_meters: float) -> tuple[float, float, float, float]:
+        # Returns (min_lat, max_lat, min_lon, max_lon) of a box containing every point within the radius
+        lat_margin = radius_meters / METERS_PER_DEGREE_LATITUDE
+        # A degree of longitude shrinks towards the poles, clamp to avoid dividing by zero
+        lon_margin = radius_meters / (METERS_PER_DEGREE_LATITUDE * max(math.cos(math.radians(latitude)), 1e-6))
+        return latitude - lat_margin, latitude + lat_margin, longitude - lon_margin, longitude + lon_margin
+
+    @staticmethod
+    def get_geocode_cache_stats() -> dict:
+        return {'reverse': REVERSE_GEOCODE_CACHE.stats(), 'forward': FORWARD_GEOCODE_CACHE.stats()}
+
+    @staticmethod
+    def get_geocoder_stats() -> dict:
+        return {
+            'reverse_lookups': REVERSE_LOOKUPS.stats(),
+            'forward_lookups': FORWARD_LOOKUPS.stats(),
+            'provider_limiter': PROVIDER_LIMITER.stats(),
+        }
@@ -0,0 +1,222 @@
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Callable, Final, Optional
+
+from Server.db_pool import ConnectionPool
+
+GEOCODE_CACHE_FILENAME: Final[str] = 'geocode_cache.db'
+COORDINATE_PRECISION: Final[int] = 3  # Decimal places kept in the key, about 110 m of latitude
+MEMORY_CACHE_ENTRIES: Final[int] = 4096
+GEOCODE_TTL: Final[timedelta] = timedelta(days=30)  # City and region names rarely change
+UNKNOWN_LOCATION: Final[tuple[str, str]] = ("Unknown", "Unknown")
+
+# Spellings users type for the same place, after case folding and punctuation removal
+CITY_ALIASES: Final[dict[str, str]] = {
+    'tel aviv yafo': 'tel aviv',
+    'tel aviv jaffa': 'tel aviv',
+    'tlv': 'tel aviv',
+    'yerushalayim': 'jerusalem',
+    'jlm': 'jerusalem',
+    'beersheba': 'beer sheva',
+    'beer sheba': 'beer sheva',
+    'rishon lezion': 'rishon letsiyon',
+    'rishon le zion': 'rishon letsiyon',
+    'petah tikva': 'petah tiqva',
+    'petach tikva': 'petah tiqva',
+}
+STATE_ALIASES: Final[dict[str, str]] = {
+    'central': 'center',
+    'merkaz': 'center',
+    'northern': 'north',
+    'hatzafon': 'north',
+    'southern': 'south',
+    'hadarom': 'south',
+}
+STREET_ABBREVIATIONS: Final[dict[str, str]] = {
+    'st': 'street',
+    'rd': 'road',
+    'ave': 'avenue',
+    'blvd': 'boulevard',
+    'sq': 'square',
+}
+
+
+class GeocodeCache:
+    """
+    Geocoding results kept in an LRU dict in front of a SQLite table, so repeated lookups skip the
+    provider and survive restarts. Entries older than the TTL are looked up again, the old value stays
+    if that fails. Subclasses name the table and its key and value columns.
+    """
+
+    TABLE_NAME = ''
+    KEY_COLUMNS: dict[str, str] = {}  # Column name -> SQLite type
+    VALUE_COLUMNS: dict[str, str] = {}
+
+    def __init__(self, pool: ConnectionPool, ttl: timedelta = GEOCODE_TTL,
+                 max_memory_entries: int = MEMORY_CACHE_ENTRIES):
+        self.pool = pool
+        self.ttl = ttl
+        self.max_memory_entries = max_memory_entries
+        self._memory: OrderedDict[tuple, tuple[tuple, datetime]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._table_created = False
+
+        self.memory_hits = 0
+        self.table_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+
+    def _create_table(self):
+        if self._table_created:
+            return
+        columns = ", ".join(
+            f"{column} {column_type} NOT NULL" for column, column_type in (self.KEY_COLUMNS | self.VALUE_COLUMNS).items()
+        )
+        with self.pool.transaction() as connection:
+            connection.execute(
+                f"""CREATE TABLE IF NOT EXISTS {self.TABLE_NAME} (
+                        {columns},
+                        fetched_at DATETIME NOT NULL,
+                        PRIMARY KEY ({", ".join(self.KEY_COLUMNS)})
+                    ) WITHOUT ROWID; """
+            )
+        self._table_created = True
+
+    def _remember(self, key: tuple, entry: tuple[tuple, datetime]):
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+
+    def _load(self, key: tuple) -> Optional[tuple[tuple, datetime]]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return entry
+
+        self._create_table()
+        where = " AND ".join(f"{column} = ?" for column in self.KEY_COLUMNS)
+        row = self.pool.get_connection().execute(
+            f"SELECT {', '.join(self.VALUE_COLUMNS)}, fetched_at FROM {self.TABLE_NAME} WHERE {where}", key
+        ).fetchone()
+        if row is None:
+            return None
+
+        entry = (tuple(row[:-1]), datetime.fromisoformat(str(row[-1])))
+        self._remember(key, entry)
+        with self._lock:
+            self.table_hits += 1
+        return entry
+
+    def _store(self, key: tuple, value: tuple):
+        fetched_at = datetime.now()
+        self._create_table()
+        columns = [*self.KEY_COLUMNS, *self.VALUE_COLUMNS]
+        updates = ", ".join(f"{column} = excluded.{column}" for column in self.VALUE_COLUMNS)
+        with self.pool.transaction() as connection:
+            connection.execute(
+                f"""
+                INSERT INTO {self.TABLE_NAME} ({", ".join(columns)}, fetched_at)
+                VALUES ({", ".join("?" * (len(columns) + 1))})
+                ON CONFLICT ({", ".join(self.KEY_COLUMNS)}) DO UPDATE SET {updates}, fetched_at = excluded.fetched_at
+            """,
+                (*key, *value, fetched_at),
+            )
+        self._remember(key, (value, fetched_at))
+
+    def lookup(self, key: tuple, fetch: Callable[[], tuple], failed: tuple) -> tuple:
+        # Calls fetch only when the key is missing or past its TTL, a failed result is returned but not stored
+        entry = self._load(key)
+        if entry is not None and datetime.now() - entry[1] < self.ttl:
+            return entry[0]
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.refreshes += 1
+
+        value = tuple(fetch())
+        if value == failed:
+            # A stale answer is still better than none
+            return entry[0] if entry is not None else failed
+
+        self._store(key, value)
+        return value
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.memory_hits + self.table_hits + self.misses + self.refreshes
+            return {
+                'memory_entries': len(self._memory),
+                'memory_hits': self.memory_hits,
+                'table_hits': self.table_hits,
+                'misses': self.misses,
+                'refreshes': self.refreshes,
+                'hit_rate': (self.memory_hits + self.table_hits) / lookups if lookups else 0.0,
+            }
+
+
+class ReverseGeocodeCache(GeocodeCache):
+    """
+    (region, city) by coordinates rounded to COORDINATE_PRECISION, so reports from the same block share one lookup.
+    """
+
+    TABLE_NAME = 'REVERSE_GEOCODE_CACHE'
+    KEY_COLUMNS = {'lat_key': 'INTEGER', 'lon_key': 'INTEGER'}
+    VALUE_COLUMNS = {'region': 'TEXT', 'city': 'TEXT'}
+
+    @staticmethod
+    def key(latitude: float, longitude: float) -> tuple[int, int]:
+        scale = 10 ** COORDINATE_PRECISION
+        return round(latitude * scale), round(longitude * scale)
+
+    def get_or_fetch(self, latitude: float, longitude: float, fetch: Callable[[], tuple[str, str]]) -> tuple[str, str]:
+        # Returns (region, city), calling fetch only when the rounded point is missing or past its TTL
+        return self.lookup(self.key(latitude, longitude), fetch, UNKNOWN_LOCATION)
+
+
+class ForwardGeocodeCache(GeocodeCache):
+    """
+    (latitude, longitude) by normalized address, so neighbours typing the same address differently share one lookup.
+    """
+
+    TABLE_NAME = 'FORWARD_GEOCODE_CACHE'
+    KEY_COLUMNS = {'address_key': 'TEXT'}
+    VALUE_COLUMNS = {'latitude': 'REAL', 'longitude': 'REAL'}
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        # Case folded words without accents or punctuation, "Be'er-Sheva " becomes "beer sheva"
+        text = unicodedata.normalize('NFKD', text).casefold()
+        text = "".join(character for character in text if not unicodedata.combining(character))
+        text = re.sub(r"['’׳]", "", text)
+        return " ".join(re.sub(r"[^\w]+", " ", text).split())
+
+    @staticmethod
+    def key(street: str, city: str, state: str) -> tuple[str]:
+        street = " ".join(
+            STREET_ABBREVIATIONS.get(word, word) for word in ForwardGeocodeCache.normalize(street).split()
+        )
+        city = ForwardGeocodeCache.normalize(city)
+        city = CITY_ALIASES.get(city, city)
+        state = ForwardGeocodeCache.normalize(state).removesuffix(" district")
+        state = STATE_ALIASES.get(state, state)
+        return f"{street}|{city}|{state}",
+
+    def get_or_fetch(self, key: tuple[str], fetch: Callable[[], tuple[Optional[float], Optional[float]]]
+                     ) -> tuple[Optional[float], Optional[float]]:
+        # Returns (latitude, longitude), (None, None) for addresses the provider does not know
+        return self.lookup(key, fetch, (None, None))
+
+
+# Shared by every thread that geocodes, the table is created on first use
+GEOCODE_CACHE_POOL: Final[ConnectionPool] = ConnectionPool(GEOCODE_CACHE_FILENAME)
+REVERSE_GEOCODE_CACHE: Final[ReverseGeocodeCache] = ReverseGeocodeCache(GEOCODE_CACHE_POOL)
+FORWARD_GEOCODE_CACHE: Final[ForwardGeocodeCache] = ForwardGeocodeCache(GEOCODE_CACHE_POOL)
@@ -0,0 +1,101 @@
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Server.event import Event, Risk
+from Server.geo_utils import GeoUtils
+from Server.offline_geocoder import OfflineGeocoder
+
+# Rough extent of Israel, the area the map is used in
+MIN_LAT, MAX_LAT, MIN_LON, MAX_LON = 29.5, 33.3, 34.2, 35.9
+SYNTHETIC_CITY_SPACING = 0.1
+SYNTHETIC_CITY_VERTICES = 64
+
+
+def circle(lat: float, lon: float, radius: float, vertices: int) -> list[list[float]]:
+    ring = [[lon + radius * math.cos(2 * math.pi * i / vertices), lat + radius * math.sin(2 * math.pi * i / vertices)]
+            for i in range(vertices)]
+    return ring + [ring[0]]
+
+
+def write_synthetic_boundaries(path: str):
+    # Five district strips across the country, with a round city every SYNTHETIC_CITY_SPACING degrees
+    features = []
+    strip = (MAX_LAT - MIN_LAT) / 5
+    for index in range(5):
+        south, north = MIN_LAT + index * strip, MIN_LAT + (index + 1) * strip
+        features.append({
+            'type': 'Feature',
+            'properties': {'kind': 'region', 'name': f"District {index}"},
+            'geometry': {'type': 'Polygon', 'coordinates': [[[MIN_LON, south], [MAX_LON, south], [MAX_LON, north],
+                                                             [MIN_LON, north], [MIN_LON, south]]]},
+        })
+
+    lat = MIN_LAT + SYNTHETIC_CITY_SPACING / 2
+    while lat < MAX_LAT:
+        lon = MIN_LON + SYNTHETIC_CITY_SPACING / 2
+        while lon < MAX_LON:
+            features.append({
+                'type': 'Feature',
+                'properties': {'kind': 'city', 'name': f"City {lat:.2f},{lon:.2f}"},
+                'geometry': {'type': 'Polygon',
+                             'coordinates': [circle(lat, lon, SYNTHETIC_CITY_SPACING / 3, SYNTHETIC_CITY_VERTICES)]},
+            })
+            lon += SYNTHETIC_CITY_SPACING
+        lat += SYNTHETIC_CITY_SPACING
+
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump({'type': 'FeatureCollection', 'features': features}, file)
+
+
+def random_points(count: int) -> list[tuple[float, float]]:
+    generator = random.Random(0)
+    return [(generator.uniform(MIN_LAT, MAX_LAT), generator.uniform(MIN_LON, MAX_LON)) for _ in range(count)]
+
+
+def benchmark(boundaries_path: str, lookups: int, online_lookups: int):
+    start = time.perf_counter()
+    geocoder = OfflineGeocoder.from_geojson(boundaries_path)
+    print(f"Index built in {time.perf_counter() - start:.3f}s, {len(geocoder.grid)} grid cells")
+
+    points = random_points(lookups)
+    start = time.perf_counter()
+    results = [geocoder.locate(lat, lon) for lat, lon in points]
+    elapsed = time.perf_counter() - start
+    found = sum(city != "Unknown" for _, city in results)
+    print(f"Offline: {lookups / elapsed:,.0f} lookups/s, {elapsed / lookups * 1e6:.1f} us each, "
+          f"{found / lookups:.0%} found a city")
+
+    if online_lookups:
+        # Nominatim allows about one request per second, so only a few points are compared
+        agree = 0
+        start = time.perf_counter()
+        for lat, lon in points[:online_lookups]:
+            event = Event(event_name="benchmark", longitude=lon, latitude=lat, risk=Risk.GOOD, region="", city="")
+            agree += GeoUtils.reverse_geocode(event) == geocoder.locate(lat, lon)
+        elapsed = time.perf_counter() - start
+        print(f"Online: {online_lookups / elapsed:,.2f} lookups/s, {elapsed / online_lookups * 1e3:.0f} ms each, "
+              f"{agree}/{online_lookups} agree with the offline answer")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compares the offline boundary geocoder with Nominatim")
+    parser.add_argument('boundaries', nargs='?', help="GeoJSON boundaries file, synthetic boundaries when omitted")
+    parser.add_argument('--lookups', type=int, default=100_000)
+    parser.add_argument('--online', type=int, default=0, help="Points to also look up through Nominatim")
+    arguments = parser.parse_args()
+
+    if arguments.boundaries:
+        benchmark(arguments.boundaries, arguments.lookups, arguments.online)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'boundaries.geojson')
+            write_synthetic_boundaries(path)
+            benchmark(path, arguments.lookups, arguments.online)
@@ -0,0 +1,89 @@
+import itertools
+import secrets
+import zlib
+from typing import Final, Iterable, Iterator, Optional
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:  # Optional, gzip is used when it is not installed
+    brotli = None
+
+# Data versions restart with the process, so an ETag from before a restart must never match
+BOOT_ID: Final[str] = secrets.token_hex(4)
+MIN_COMPRESSED_BYTES: Final[int] = 1024  # Smaller bodies are not worth the compression CPU
+GZIP_LEVEL: Final[int] = 5
+BROTLI_QUALITY: Final[int] = 5
+# Clients may keep the body, but have to revalidate it with the ETag before every use
+CACHE_CONTROL: Final[str] = "no-cache"
+# Map tiles may also be kept by shared caches, which revalidate them the same way
+TILE_CACHE_CONTROL: Final[str] = "public, no-cache"
+
+
+def data_etag(*versions: int) -> str:
+    # Changes whenever one of the tables the response is built from is written to
+    return "-".join([BOOT_ID, *(str(version) for version in versions)])
+
+
+def not_modified(etag: str, cache_control: str = CACHE_CONTROL) -> Optional[Response]:
+    # A 304 when the client already holds this version, checked before any query runs
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    response = Response(status=304)
+    response.set_etag(etag, weak=True)
+    response.headers["Cache-Control"] = cache_control
+    # The same Vary as the full response, a 304 updates the headers of the stored copy
+    response.vary.update(("Accept", "Accept-Encoding"))
+    return response
+
+
+def choose_encoding() -> Optional[str]:
+    offered = ["br", "gzip"] if brotli is not None else ["gzip"]
+    return request.accept_encodings.best_match(offered)
+
+
+def compress_chunks(chunks: Iterable[str], encoding: str) -> Iterator[bytes]:
+    # Compresses while streaming, so large marker lists are never held in memory
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        for chunk in chunks:
+            data = compressor.process(chunk.encode())
+            if data:
+                yield data
+        yield compressor.finish()
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip container
+        for chunk in chunks:
+            data = compressor.compress(chunk.encode())
+            if data:
+                yield data
+        yield compressor.flush()
+
+
+def cached_response(chunks: Iterable[str], mimetype: str, etag: str, cache_control: str = CACHE_CONTROL) -> Response:
+    """
+    A response with the ETag and Cache-Control headers, compressed when the client accepts it and the
+    body reaches MIN_COMPRESSED_BYTES. Only the start of a streamed body is read ahead to decide.
+    """
+    chunks = iter(chunks)
+    encoding = choose_encoding()
+    head, size = [], 0
+    while encoding and size < MIN_COMPRESSED_BYTES:
+        chunk = next(chunks, None)
+        if chunk is None:
+            break
+        head.append(chunk)
+        size += len(chunk)
+
+    body = itertools.chain(head, chunks)
+    if encoding and size >= MIN_COMPRESSED_BYTES:
+        response = Response(compress_chunks(body, encoding), mimetype=mimetype)
+        response.headers["Content-Encoding"] = encoding
+    else:
+        response = Response(body, mimetype=mimetype)
+
+    response.set_etag(etag, weak=True)
+    response.headers["Cache-Control"] = cache_control
+    response.vary.update(("Accept", "Accept-Encoding"))
+    return response
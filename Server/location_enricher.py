@@ -0,0 +1,154 @@
+import atexit
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Final, Optional
+
+from Server.event import Event, Risk
+from Server.storage_engine import EVENT_TABLES, StorageEngine
+from Server.write_queue import WriteQueue
+
+ENRICH_BATCH_SIZE: Final[int] = 100  # Pending events resolved and written back per round
+ENRICH_WORKERS: Final[int] = 4  # Requests to the provider are paced by the GeoUtils limiter, cache hits are not
+IDLE_POLL_SECONDS: Final[float] = 30.0  # Catches events left pending by a restart or a failed lookup
+RETRY_BASE_SECONDS: Final[float] = 60.0  # An event whose lookup failed is skipped this long, doubled per failure
+RETRY_MAX_SECONDS: Final[float] = 6 * 60 * 60.0
+STOP_TIMEOUT_SECONDS: Final[float] = 5.0
+
+
+class LocationEnricher:
+    """
+    Fills in the region and city of events that were stored with a pending location.
+    A small worker pool geocodes the distinct coordinates of a batch and the results go back through
+    the write queue as one update per table.
+    Woken by the write queue after deferred inserts, otherwise polls every IDLE_POLL_SECONDS.
+    Each table is paged by id from a cursor that wraps around at the end, and an event whose lookup
+    failed is skipped with a growing backoff, so failing events never hold back the ones behind them.
+    """
+
+    def __init__(self, engine: StorageEngine, write_queue: WriteQueue, workers: int = ENRICH_WORKERS):
+        self.engine = engine
+        self.write_queue = write_queue
+        self.workers = workers
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._cursors: dict[str, int] = {}  # Last id looked at per table
+        self._retries: dict[tuple[str, int], tuple[int, float]] = {}  # (table, id) -> (failures, retry at)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+        self.rounds = 0
+        self.lookups = 0
+        self.failed_lookups = 0
+        self.events_located = 0
+
+        write_queue.add_listener(self.notify)
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+                # The worker pool threads are not daemons, so the round in progress is ended at exit
+                atexit.register(self.stop)
+
+    def stop(self):
+        # Ends the round in progress and shuts the worker pool down
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(STOP_TIMEOUT_SECONDS)
+
+    def notify(self, table_name: Optional[str] = None):
+        self.start()
+        self._wake.set()
+
+    def _run(self):
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='location-enricher') as executor:
+            while not self._stopping.is_set():
+                self._wake.wait(IDLE_POLL_SECONDS)
+                self._wake.clear()
+                try:
+                    # Keep going while there is progress, a round without any resolved event waits for the next wake
+                    while not self._stopping.is_set() and self.enrich_round(executor):
+                        pass
+                except Exception as e:
+                    if not self._stopping.is_set():
+                        print(f"Error enriching event locations: {e}")
+
+    def _locate(self, latitude: float, longitude: float) -> Optional[tuple[str, str]]:
+        if self._stopping.is_set():
+            return None
+        try:
+            return self.engine.geocoder(
+                Event(event_name="", longitude=longitude, latitude=latitude, risk=Risk.GOOD, region="", city="")
+            )
+        except Exception as e:
+            # The event stays pending and is tried again after its backoff
+            print(f"Error geocoding ({latitude}, {longitude}): {e}")
+            return None
+
+    def _retry_later(self, table_name: str, db_id: int, now: float):
+        failures = self._retries.get((table_name, db_id), (0, 0.0))[0] + 1
+        delay = min(RETRY_BASE_SECONDS * 2 ** (failures - 1), RETRY_MAX_SECONDS)
+        self._retries[(table_name, db_id)] = (failures, now + delay)
+
+    def _forget_located(self, table_name: str, after_id: int, last_id: float, pending_ids: set[int]):
+        # Events the page skipped over were located or deleted since they failed
+        for key in [key for key in self._retries
+                    if key[0] == table_name and after_id < key[1] <= last_id and key[1] not in pending_ids]:
+            del self._retries[key]
+
+    def enrich_round(self, executor: ThreadPoolExecutor) -> bool:
+        # Resolves the next batch of each table, returns True when any event got its location or pages remain
+        self.rounds += 1
+        progressed = False
+        now = time.monotonic()
+        for table_name in EVENT_TABLES:
+            after_id = self._cursors.get(table_name, 0)
+            page = self.engine.fetch_pending_locations(table_name, ENRICH_BATCH_SIZE, after_id)
+            # A short page is the end of the table, the next round starts over from the first pending event
+            if len(page) < ENRICH_BATCH_SIZE:
+                self._cursors[table_name] = 0
+                last_id = float('inf')
+            else:
+                self._cursors[table_name] = last_id = page[-1][0]
+                progressed = True
+            self._forget_located(table_name, after_id, last_id, {db_id for db_id, _, _ in page})
+            pending = [
+                (db_id, latitude, longitude) for db_id, latitude, longitude in page
+                if self._retries.get((table_name, db_id), (0, 0.0))[1] <= now
+            ]
+            if not pending:
+                continue
+
+            coordinates = list({(latitude, longitude) for _, latitude, longitude in pending})
+            results = dict(zip(coordinates, executor.map(lambda point: self._locate(*point), coordinates)))
+            if self._stopping.is_set():
+                return False
+            self.lookups += len(coordinates)
+            self.failed_lookups += sum(result is None for result in results.values())
+
+            locations = []
+            for db_id, latitude, longitude in pending:
+                result = results[(latitude, longitude)]
+                if result is None:
+                    self._retry_later(table_name, db_id, now)
+                else:
+                    self._retries.pop((table_name, db_id), None)
+                    locations.append((db_id, *result))
+            if locations:
+                updated = self.write_queue.update_locations(table_name, locations).result()
+                self.events_located += updated
+                progressed = True
+                print(f"Located {updated} pending events in {table_name}")
+        return progressed
+
+    def stats(self) -> dict:
+        return {
+            'rounds': self.rounds,
+            'lookups': self.lookups,
+            'failed_lookups': self.failed_lookups,
+            'events_located': self.events_located,
+            'retries_pending': len(self._retries),
+        }
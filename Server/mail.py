@@ -1,12 +1,10 @@
 import imaplib
 import os
 import smtplib
-import sqlite3
 
 from Server.user import User
 from dotenv import load_dotenv
 from Server.event import Event
-from Server.event import Risk
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 import email
@@ -80,6 +78,32 @@ class Mail:
             print(f"Failed to send email to {user.mail_address}: {e}")
             return False
 
+    @staticmethod
+    def promote_confirmed_events(mail, pending_promotions: dict[int, list], insert_success: list,
+                                 insert_failures: list, processed_email_ids: set):
+        # Moves every confirmed admin event into the main DB at once, reusing the stored region and city
+        try:
+            print(f"Promoting {len(pending_promotions)} confirmed events into the main database...")
+            promoted = set(EveMapDAL.promote_admin_events(list(pending_promotions)))
+        except Exception as db_e:
+            # The emails stay unread, so the next check retries them
+            print(f"  - FAILED to promote confirmed events: {db_e}")
+            for confirmations in pending_promotions.values():
+                insert_failures.append(f"Event {confirmations[0][1]} (DB Error: {db_e})")
+            return
+
+        for event_id, confirmations in pending_promotions.items():
+            event_display = confirmations[0][1]
+            if event_id in promoted:
+                print(f"  - Successfully promoted event ID {event_id}.")
+                insert_success.append(f"Event {event_display}")
+            else:
+                insert_failures.append(f"Event {event_display} (No longer in the admin events)")
+
+            for email_id_bytes, _ in confirmations:
+                mail.store(email_id_bytes, '+FLAGS', '\\Seen')
+                processed_email_ids.add(email_id_bytes.decode())
+
     @staticmethod
     def check_email(current_event_map: list[Event]):
         # Load email configuration values
@@ -101,6 +125,7 @@ class Mail:
         insert_failures = []  # Confirmed events failed to insert
         errors = []  # General processing errors
         processed_email_ids = set()  # Email IDs that were already handled
+        pending_promotions = {}  # Confirmed event ID -> (email ID, event display) of every confirmation
 
         try:
             # Connect to IMAP server and select inbox
@@ -201,43 +226,17 @@ class Mail:
                                         print(f"  - CONFIRMED: Event {event_display} by {sender_email_addr}")
                                         confirmations_processed.append(f"Event {event_display} by {sender_email_addr}")
 
-                                        try:
-                                            print(f"  - Inserting confirmed event {event_id} into main database...")
-                                            confirmed_event.print_event()
-                                            confirmed_event.risk = Risk(confirmed_event.risk)
-                                            EveMapDAL.insert_event(confirmed_event)
-                                            print(f"  - Successfully inserted event ID {event_id}.")
-                                            insert_success.append(f"Event {event_display}")
-                                            mail.store(email_id_bytes, '+FLAGS', '\\Seen')
-                                            processed_email_ids.add(email_id_str)
-
-                                            # Attempt to delete event from admin table
-                                            try:
-                                                EveMapDAL.delete_event(event_id)
-                                                print(f"  - Deleted event ID {event_id} from DB.")
-                                            except Exception as del_e:
-                                                error_msg = f"Failed to delete event ID {event_id} from DB: {del_e}"
-                                                print(f"  - {error_msg}")
-                                                errors.append(error_msg)
-
-                                        except sqlite3.IntegrityError as ie:
-                                            err_msg = f"Event {event_display} (Already exists or constraint violation: {ie})"
-                                            print(
-                                                f"  - DB Integrity Error inserting event ID {event_id}: {ie}. Might already exist.")
-                                            insert_failures.append(err_msg)
-                                            mail.store(email_id_bytes, '+FLAGS', '\\Seen')
-                                            processed_email_ids.add(email_id_str)
-                                        except Exception as db_e:
-                                            err_msg = f"Event {event_display} (DB Error: {db_e})"
-                                            print(f"  - FAILED to insert event ID {event_id} into main DB: {db_e}")
-                                            insert_failures.append(err_msg)
+                                        # Promoted together once the inbox is read, in a single transaction
+                                        pending_promotions.setdefault(event_id, []).append(
+                                            (email_id_bytes, event_display)
+                                        )
 
                                     # Case: denial email
                                     elif any(term in body_lower for term in ["deny", "denied"]):
                                         print(f"  - DENIED: Event {event_display} by {sender_email_addr}")
                                         denials_processed.append(f"Event {event_display} by {sender_email_addr}")
                                         try:
-                                            EveMapDAL.delete_event(event_id)
+                                            EveMapDAL.delete_admin_event(event_id)
                                             print(f"  - Deleted event ID {event_id} from admin DB (due to denial).")
                                         except Exception as del_e:
                                             error_msg = f"Failed to delete denied event ID {event_id} from admin DB: {del_e}"
@@ -263,6 +262,11 @@ class Mail:
                                         errors.append(
                                             f"Could not mark email {email_id_str} as seen after parse error: {mark_seen_err}")
 
+                if pending_promotions:
+                    Mail.promote_confirmed_events(
+                        mail, pending_promotions, insert_success, insert_failures, processed_email_ids
+                    )
+
             else:
                 print(f"Failed to search emails: {messages}")
                 errors.append(f"Failed to search for emails in inbox (Status: {status}, Response: {messages}).")
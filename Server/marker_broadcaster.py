@@ -0,0 +1,198 @@
+import json
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Final, Iterator, Optional
+
+from Server.event import Event, EventChange
+from Server.storage_engine import BoundingBox, StorageEngine
+
+SUBSCRIBER_QUEUE_SIZE: Final[int] = 256  # A client this far behind is dropped and resumes from the change log
+HEARTBEAT_SECONDS: Final[float] = 15.0  # Keeps proxies from closing idle streams and finds closed tabs
+VERSION_POLL_SECONDS: Final[float] = 0.25  # The data version is an in-memory counter, not a query
+CHANGES_PAGE_SIZE: Final[int] = 1_000
+RECONNECT_MILLISECONDS: Final[int] = 3_000
+
+
+@dataclass(slots=True)
+class MarkerFilter:
+    # The same filters as /api/all_markers, None matches everything
+    city: Optional[str] = None
+    region: Optional[str] = None
+    risk: Optional[int] = None
+    bounding_box: Optional[BoundingBox] = None
+
+    def matches(self, event: Event) -> bool:
+        if self.city is not None and event.city != self.city:
+            return False
+        if self.region is not None and event.region != self.region:
+            return False
+        if self.risk is not None and event.risk.value != self.risk:
+            return False
+        if self.bounding_box is not None:
+            min_lat, max_lat, min_lon, max_lon = self.bounding_box
+            return min_lat <= event.latitude <= max_lat and min_lon <= event.longitude <= max_lon
+        return True
+
+
+class Subscriber:
+    def __init__(self, marker_filter: MarkerFilter):
+        self.marker_filter = marker_filter
+        # None wakes the stream up after the subscriber was dropped
+        self.queue: queue.Queue[Optional[str]] = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.dropped = False
+        self.queued = 0
+
+    def offer(self, change: EventChange) -> bool:
+        # Queues the change as an SSE message when the filter wants it, False when the queue is full
+        op = change.op
+        if not self.marker_filter.matches(change.event):
+            # A location update can move a marker out of a city or region filter, the client removes it
+            if op != 'update' or (self.marker_filter.city is None and self.marker_filter.region is None):
+                return True
+            op = 'delete'
+        elif op == 'expire':
+            op = 'delete'
+        message = f"id: {change.seq}\nevent: {op}\ndata: {json.dumps(change.event.to_dict_risk_is_int())}\n\n"
+        try:
+            self.queue.put_nowait(message)
+            self.queued += 1
+            return True
+        except queue.Full:
+            return False
+
+
+class MarkerBroadcaster:
+    """
+    Pushes committed marker changes to Server-Sent Events streams.
+    One thread watches the table's data version and reads each new page of the change log once,
+    then fans it out to the subscribers whose filter matches, so open map tabs cost no queries.
+    A subscriber whose queue fills up is dropped, its browser reconnects with Last-Event-ID and
+    is replayed from the change log, or told to reload when the log no longer reaches back that far.
+    """
+
+    def __init__(self, engine: StorageEngine, table_name: str = 'EVENTS'):
+        self.engine = engine
+        self.table_name = table_name
+        self._subscribers: set[Subscriber] = set()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self.cursor = 0
+
+        self.changes_read = 0
+        self.messages_queued = 0
+        self.subscribers_dropped = 0
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self.cursor = self.engine.get_latest_change_seq()
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        version = self.engine.get_data_version(self.table_name)
+        while True:
+            time.sleep(VERSION_POLL_SECONDS)
+            latest_version = self.engine.get_data_version(self.table_name)
+            if latest_version == version:
+                continue
+            version = latest_version
+            try:
+                self.publish_changes()
+            except Exception as e:
+                print(f"Error broadcasting marker changes: {e}")
+
+    def publish_changes(self):
+        while True:
+            changes = self.engine.get_changes(self.table_name, self.cursor, CHANGES_PAGE_SIZE)
+            with self._lock:
+                if changes is None:
+                    # The log was trimmed past the cursor, every client has to reload
+                    self.cursor = self.engine.get_latest_change_seq()
+                    for subscriber in list(self._subscribers):
+                        self._drop(subscriber)
+                    return
+                if not changes:
+                    return
+
+                self.changes_read += len(changes)
+                for subscriber in list(self._subscribers):
+                    queued = subscriber.queued
+                    if not all(subscriber.offer(change) for change in changes):
+                        self._drop(subscriber)
+                    self.messages_queued += subscriber.queued - queued
+                self.cursor = changes[-1].seq
+            if len(changes) < CHANGES_PAGE_SIZE:
+                return
+
+    def _drop(self, subscriber: Subscriber):
+        # Called with the lock held, the stream notices and closes so the browser reconnects
+        subscriber.dropped = True
+        self._subscribers.discard(subscriber)
+        self.subscribers_dropped += 1
+        try:
+            subscriber.queue.put_nowait(None)
+        except queue.Full:
+            pass  # The stream is busy draining and sees the flag next
+
+    def _subscribe(self, marker_filter: MarkerFilter, last_seq: Optional[int]) -> tuple[Subscriber, bool]:
+        # Returns the subscriber and whether the client has to reload instead of being replayed
+        self.start()
+        subscriber = Subscriber(marker_filter)
+        with self._lock:
+            # Replays what the client missed up to the broadcaster cursor, later changes are fanned out.
+            # A cursor ahead of the log comes from before a restart of the memory engine
+            reload = last_seq is not None and last_seq > self.cursor
+            since = last_seq
+            while not reload and since is not None and since < self.cursor:
+                changes = self.engine.get_changes(self.table_name, since, CHANGES_PAGE_SIZE)
+                if changes is None:
+                    reload = True
+                    break
+                changes = [change for change in changes if change.seq <= self.cursor]
+                if not changes:
+                    break
+                reload = not all(subscriber.offer(change) for change in changes)
+                since = changes[-1].seq
+            if not reload:
+                # Tells the client where the stream starts after the replay, so it can resume from there
+                # before any change arrives
+                try:
+                    subscriber.queue.put_nowait(f"id: {self.cursor}\nevent: ready\ndata: {{}}\n\n")
+                except queue.Full:
+                    reload = True
+            if reload:
+                subscriber = Subscriber(marker_filter)
+            self._subscribers.add(subscriber)
+        return subscriber, reload
+
+    def stream(self, marker_filter: MarkerFilter, last_seq: Optional[int] = None) -> Iterator[str]:
+        # The text/event-stream body for one client, subscribed when the response starts
+        subscriber, reload = self._subscribe(marker_filter, last_seq)
+        try:
+            yield f"retry: {RECONNECT_MILLISECONDS}\n\n"
+            if reload:
+                yield f"id: {self.cursor}\nevent: reload\ndata: {{}}\n\n"
+            while not subscriber.dropped:
+                try:
+                    message = subscriber.queue.get(timeout=HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    message = ": heartbeat\n\n"
+                if message is not None:
+                    yield message
+        finally:
+            with self._lock:
+                self._subscribers.discard(subscriber)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'subscribers': len(self._subscribers),
+                'cursor': self.cursor,
+                'changes_read': self.changes_read,
+                'messages_queued': self.messages_queued,
+                'subscribers_dropped': self.subscribers_dropped,
+            }
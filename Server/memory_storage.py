@@ -0,0 +1,391 @@
+import heapq
+import itertools
+import math
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from typing import ContextManager, Final, Iterator, Optional
+
+from Server.event import Event, EventBatch, EventChange, Risk
+from Server.expiration import DEFAULT_TTLS
+from Server.storage_engine import CHANGE_LOG_SIZE, EVENT_TABLES, FETCH_BATCH_SIZE, BoundingBox, StorageEngine
+from Server.user import User
+
+GRID_CELL_DEGREES: Final[float] = 0.01  # Roughly 1 km cells for the spatial lookups
+
+
+class MemoryEventTable:
+    """
+    One event table held in dicts: rows by id plus the same secondary indexes the SQLite schema has,
+    (city, risk), (region, risk), risk and a uniform grid standing in for the R*Tree.
+    """
+
+    def __init__(self):
+        # id -> (id, event_name, latitude, longitude, risk, city, region, created_at)
+        self.rows: dict[int, tuple] = {}
+        self.next_id = 1
+        self.by_city_risk: dict[tuple[str, int], set[int]] = {}
+        self.by_region_risk: dict[tuple[str, int], set[int]] = {}
+        self.by_risk: dict[int, set[int]] = {}
+        self.grid: dict[tuple[int, int], set[int]] = {}
+        self.pending: set[int] = set()  # Stored as 'Unknown' until the location is filled in
+
+    @staticmethod
+    def cell(latitude: float, longitude: float) -> tuple[int, int]:
+        return math.floor(latitude / GRID_CELL_DEGREES), math.floor(longitude / GRID_CELL_DEGREES)
+
+    def add(self, event_name: str, latitude: float, longitude: float, risk: int, city: Optional[str],
+            region: Optional[str], created_at: datetime) -> int:
+        identity = self.next_id
+        self.next_id += 1
+        if city is None:
+            city = region = 'Unknown'
+            self.pending.add(identity)
+        self.rows[identity] = (identity, event_name, latitude, longitude, risk, city, region, created_at)
+        self._index(identity)
+        return identity
+
+    def _index(self, identity: int):
+        _, _, latitude, longitude, risk, city, region, _ = self.rows[identity]
+        self.by_city_risk.setdefault((city, risk), set()).add(identity)
+        self.by_region_risk.setdefault((region, risk), set()).add(identity)
+        self.by_risk.setdefault(risk, set()).add(identity)
+        self.grid.setdefault(self.cell(latitude, longitude), set()).add(identity)
+
+    def remove(self, identity: int) -> Optional[tuple]:
+        row = self.rows.pop(identity, None)
+        if row is None:
+            return None
+        self.pending.discard(identity)
+
+        _, _, latitude, longitude, risk, city, region, _ = row
+        for index, key in (
+                (self.by_city_risk, (city, risk)),
+                (self.by_region_risk, (region, risk)),
+                (self.by_risk, risk),
+                (self.grid, self.cell(latitude, longitude)),
+        ):
+            index[key].discard(identity)
+            if not index[key]:
+                del index[key]
+        return row
+
+    def locate(self, identity: int, region: str, city: str) -> bool:
+        # Fills in a pending location, re-adding the row so the city and region indexes follow
+        if identity not in self.pending:
+            return False
+        _, event_name, latitude, longitude, risk, _, _, created_at = self.rows[identity]
+        self.remove(identity)
+        self.rows[identity] = (identity, event_name, latitude, longitude, risk, city, region, created_at)
+        self._index(identity)
+        return True
+
+    def ids_in_box(self, bounding_box: BoundingBox) -> Iterator[int]:
+        min_lat, max_lat, min_lon, max_lon = bounding_box
+        min_row, min_column = self.cell(min_lat, min_lon)
+        max_row, max_column = self.cell(max_lat, max_lon)
+
+        # Large boxes (a whole batch group) cover more cells than are occupied, walk the occupied ones instead
+        if (max_row - min_row + 1) * (max_column - min_column + 1) > len(self.grid):
+            cells = [
+                cell for cell in self.grid
+                if min_row <= cell[0] <= max_row and min_column <= cell[1] <= max_column
+            ]
+        else:
+            cells = [
+                (grid_row, grid_column)
+                for grid_row in range(min_row, max_row + 1)
+                for grid_column in range(min_column, max_column + 1)
+            ]
+
+        for cell in cells:
+            for identity in self.grid.get(cell, ()):
+                _, _, latitude, longitude, *_ = self.rows[identity]
+                if min_lat <= latitude <= max_lat and min_lon <= longitude <= max_lon:
+                    yield identity
+
+    def matching_ids(self, city=None, region=None, risk=None, bounding_box: Optional[BoundingBox] = None) -> list[int]:
+        # Starts from the narrowest index available for the filter, then checks the remaining conditions
+        risks = [risk] if risk is not None else [r.value for r in Risk]
+        if bounding_box is not None:
+            candidates = {
+                identity for identity in self.ids_in_box(bounding_box)
+                if not city or self.rows[identity][5] == city
+            }
+        elif city:
+            candidates = set().union(*(self.by_city_risk.get((city, r), ()) for r in risks))
+        elif region:
+            candidates = set().union(*(self.by_region_risk.get((region, r), ()) for r in risks))
+        elif risk is not None:
+            candidates = self.by_risk.get(risk, set())
+        else:
+            candidates = self.rows.keys()
+
+        return sorted(
+            identity for identity in candidates
+            if (not region or self.rows[identity][6] == region) and (risk is None or self.rows[identity][4] == risk)
+        )
+
+
+class MemoryStorageEngine(StorageEngine):
+    """
+    Keeps events and users in process memory behind a single lock, nothing survives a restart.
+    Meant for development and for comparing the storage code paths against the SQLite engine.
+    """
+
+    def __init__(self, ttls: dict[str, dict[Risk, Optional[timedelta]]] = DEFAULT_TTLS, **kwargs):
+        super().__init__(**kwargs)
+        self.ttls = ttls
+        self.tables = {table_name: MemoryEventTable() for table_name in EVENT_TABLES}
+        self.users: dict[str, User] = {}
+        self.versions: dict[str, int] = {table_name: 0 for table_name in EVENT_TABLES}
+        self.expired_counts: dict[str, int] = {table_name: 0 for table_name in EVENT_TABLES}
+        # (seq, table_name, op, row) with consecutive sequence numbers, the oldest drop off at CHANGE_LOG_SIZE
+        self.changes: deque[tuple[int, str, str, tuple]] = deque(maxlen=CHANGE_LOG_SIZE)
+        self.last_change_seq = 0
+
+        self._lock = threading.RLock()
+        self._expiry_condition = threading.Condition(self._lock)
+        self._expiry_heap: list[tuple[datetime, str, int]] = []
+        self._cleanup_thread: Optional[threading.Thread] = None
+
+    def _log_change(self, table_name: str, op: str, row: tuple):
+        # Called with the lock held, right where the row is added, changed or removed
+        self.last_change_seq += 1
+        self.changes.append((self.last_change_seq, table_name, op, row))
+
+    # --- Lifecycle and monitoring ---
+
+    def create_database(self):
+        # Nothing to create, the tables exist as soon as the engine does
+        pass
+
+    def start_cleanup_thread(self):
+        with self._lock:
+            if self._cleanup_thread is None:
+                self._cleanup_thread = threading.Thread(target=self._run_cleanup, daemon=True)
+                self._cleanup_thread.start()
+
+    def _run_cleanup(self):
+        with self._expiry_condition:
+            while True:
+                self._expire_due()
+                timeout = (self._expiry_heap[0][0] - datetime.now()).total_seconds() if self._expiry_heap else None
+                self._expiry_condition.wait(timeout)
+
+    def _expire_due(self) -> int:
+        expired = 0
+        now = datetime.now()
+        with self._lock:
+            while self._expiry_heap and self._expiry_heap[0][0] <= now:
+                _, table_name, identity = heapq.heappop(self._expiry_heap)
+                row = self.tables[table_name].remove(identity)
+                if row is not None:
+                    self._log_change(table_name, 'expire', row)
+                    self.versions[table_name] += 1
+                    self.expired_counts[table_name] += 1
+                    expired += 1
+        return expired
+
+    def cleanup_database(self) -> int:
+        return self._expire_due()
+
+    def get_data_version(self, table_name: str) -> int:
+        with self._lock:
+            return self.versions.get(table_name, 0)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                'engine': 'memory',
+                'events': {table_name: len(table.rows) for table_name, table in self.tables.items()},
+                'users': len(self.users),
+                'versions': dict(self.versions),
+                'expiration': {
+                    'expired': dict(self.expired_counts),
+                    'next_expiry': self._expiry_heap[0][0].isoformat() if self._expiry_heap else None,
+                },
+            }
+
+    def transaction(self) -> ContextManager:
+        # Holding the lock keeps every reader out until the whole group of writes is applied
+        return self._lock
+
+    def mark_changed(self, table_name: str):
+        with self._lock:
+            self.versions[table_name] += 1
+
+    # --- Events and admin events ---
+
+    def write_events(
+            self, table_name: str, located_events: list[tuple[Event, Optional[str], Optional[str]]], created_at: datetime
+    ):
+        with self._expiry_condition:
+            table = self.tables[table_name]
+            for event, region, city in located_events:
+                identity = table.add(
+                    event.event_name, event.latitude, event.longitude, event.risk.value, city, region, created_at
+                )
+                self._log_change(table_name, 'insert', table.rows[identity])
+                ttl = self.ttls.get(table_name, {}).get(Risk(event.risk.value))
+                if ttl is not None:
+                    heapq.heappush(self._expiry_heap, (created_at + ttl, table_name, identity))
+            self.versions[table_name] += 1
+            self._expiry_condition.notify()
+
+    def fetch_pending_locations(self, table_name: str, limit: int, after_id: int = 0) -> list[tuple[int, float, float]]:
+        with self._lock:
+            table = self.tables[table_name]
+            return [(identity, table.rows[identity][2], table.rows[identity][3])
+                    for identity in sorted(identity for identity in table.pending if identity > after_id)[:limit]]
+
+    def update_locations(self, table_name: str, locations: list[tuple[int, str, str]]) -> int:
+        with self._lock:
+            table = self.tables[table_name]
+            updated = 0
+            for db_id, region, city in locations:
+                if table.locate(db_id, region, city):
+                    self._log_change(table_name, 'update', table.rows[db_id])
+                    updated += 1
+            if updated:
+                self.versions[table_name] += 1
+        return updated
+
+    def fetch_similar_candidates(
+            self, table_name: str, bounding_box: BoundingBox, event_name: str, risk_value: int
+    ) -> list[tuple[float, float]]:
+        with self._lock:
+            table = self.tables[table_name]
+            return [
+                (table.rows[identity][2], table.rows[identity][3])
+                for identity in table.ids_in_box(bounding_box)
+                if table.rows[identity][1] == event_name and table.rows[identity][4] == risk_value
+            ]
+
+    def fetch_all_coordinates_from_table(
+            self, table_name: str, city=None, region=None, risk=None, bounding_box: Optional[BoundingBox] = None
+    ) -> EventBatch:
+        with self._lock:
+            table = self.tables[table_name]
+            return EventBatch.from_rows(
+                [table.rows[identity][:7] for identity in table.matching_ids(city, region, risk, bounding_box)]
+            )
+
+    def iter_event_batches(
+            self,
+            table_name: str,
+            city=None,
+            region=None,
+            risk=None,
+            after_id: int = 0,
+            limit: Optional[int] = None,
+            batch_size: int = FETCH_BATCH_SIZE,
+            bounding_box: Optional[BoundingBox] = None,
+    ) -> Iterator[EventBatch]:
+        with self._lock:
+            identities = [
+                identity for identity in self.tables[table_name].matching_ids(city, region, risk, bounding_box)
+                if identity > after_id
+            ]
+        if limit is not None:
+            identities = identities[:limit]
+
+        for start in range(0, len(identities), batch_size):
+            with self._lock:
+                rows = self.tables[table_name].rows
+                # Rows deleted since the ids were collected are skipped, like a later keyset page would
+                batch = [rows[identity][:7] for identity in identities[start:start + batch_size] if identity in rows]
+            if batch:
+                yield EventBatch.from_rows(batch)
+
+    def get_filter_facets(self) -> dict[str, list[dict]]:
+        with self._lock:
+            table = self.tables['EVENTS']
+            facets = {}
+            for key, index in (('cities', table.by_city_risk), ('regions', table.by_region_risk)):
+                by_name: dict[str, dict] = {}
+                for (name, risk), identities in sorted(index.items()):
+                    # Pending events are only counted once their location is known, as in the SQLite facets
+                    count = len(identities - table.pending) if table.pending else len(identities)
+                    if count:
+                        by_name.setdefault(name, {'name': name, 'counts': {}})['counts'][risk] = count
+                facets[key] = list(by_name.values())
+            return facets
+
+    def delete_event_from_table(self, db_id: int, table_name: str) -> bool:
+        with self._lock:
+            row = self.tables[table_name].remove(db_id) if self.is_valid_table(table_name) else None
+            if row is None:
+                print(f"Warning: No event found with id {db_id}. No rows deleted.")
+                return False
+            self._log_change(table_name, 'delete', row)
+            self.versions[table_name] += 1
+
+        print(f"Successfully deleted event with id {db_id}.")
+        return True
+
+    def promote_admin_events(self, db_ids: list[int]) -> list[int]:
+        promoted = []
+        created_at = datetime.now()  # The TTL in EVENTS starts at the confirmation
+        with self._expiry_condition:
+            pending = self.tables['ADMIN_EVENTS'].pending & set(db_ids)
+            for db_id in sorted(set(db_ids)):
+                row = self.tables['ADMIN_EVENTS'].remove(db_id)
+                if row is None:
+                    continue
+                self._log_change('ADMIN_EVENTS', 'delete', row)
+
+                _, event_name, latitude, longitude, risk, city, region, _ = row
+                if db_id in pending:
+                    city = region = None
+                identity = self.tables['EVENTS'].add(event_name, latitude, longitude, risk, city, region, created_at)
+                self._log_change('EVENTS', 'insert', self.tables['EVENTS'].rows[identity])
+                ttl = self.ttls.get('EVENTS', {}).get(Risk(risk))
+                if ttl is not None:
+                    heapq.heappush(self._expiry_heap, (created_at + ttl, 'EVENTS', identity))
+                promoted.append(db_id)
+
+            if promoted:
+                self.versions['EVENTS'] += 1
+                self.versions['ADMIN_EVENTS'] += 1
+                self._expiry_condition.notify()
+
+        return promoted
+
+    # --- Change log ---
+
+    def get_latest_change_seq(self) -> int:
+        with self._lock:
+            return self.last_change_seq
+
+    def get_changes(self, table_name: str, since: int, limit: int) -> Optional[list[EventChange]]:
+        with self._lock:
+            oldest = self.changes[0][0] if self.changes else self.last_change_seq + 1
+            if since > self.last_change_seq or since < oldest - 1:
+                return None
+
+            # Sequence numbers are consecutive, so the first record after the cursor sits at a known position
+            records = itertools.islice(self.changes, since - oldest + 1, None)
+            matching = (record for record in records if record[1] == table_name)
+            return [
+                EventChange(seq, op, Event(event_name=row[1], longitude=row[3], latitude=row[2], risk=Risk(row[4]),
+                                           region=row[6], city=row[5], identity=row[0]))
+                for seq, _, op, row in itertools.islice(matching, limit)
+            ]
+
+    # --- Users ---
+
+    def insert_user(self, user: User) -> bool:
+        with self._lock:
+            if user.mail_address in self.users:
+                raise ValueError(f"A user with the mail address {user.mail_address} already exists")
+            self.users[user.mail_address] = user
+        return True
+
+    def get_user_by_email(self, email: str) -> Optional[User]:
+        with self._lock:
+            return self.users.get(email)
+
+    def get_all_users(self) -> list[User]:
+        with self._lock:
+            return list(self.users.values())
@@ -0,0 +1,116 @@
+import json
+import math
+from typing import Final
+
+GRID_CELL_DEGREES: Final[float] = 0.05  # About 5 km, a city polygon usually spans a handful of cells
+UNKNOWN: Final[str] = "Unknown"
+
+Ring = list[tuple[float, float]]  # (lon, lat) vertices, GeoJSON order
+
+
+class BoundaryPolygon:
+    """
+    One district or city boundary: a GeoJSON Polygon or MultiPolygon flattened to a list of
+    (outer ring, holes) parts with a precomputed bounding box.
+    """
+
+    def __init__(self, kind: str, name: str, parts: list[tuple[Ring, list[Ring]]]):
+        self.kind = kind
+        self.name = name
+        self.parts = parts
+        lons = [lon for outer, _ in parts for lon, _ in outer]
+        lats = [lat for outer, _ in parts for _, lat in outer]
+        self.min_lon, self.max_lon = min(lons), max(lons)
+        self.min_lat, self.max_lat = min(lats), max(lats)
+        # Smaller polygons are checked first, so a city inside a larger one wins
+        self.area = sum(abs(BoundaryPolygon.ring_area(outer)) for outer, _ in parts)
+
+    @staticmethod
+    def ring_area(ring: Ring) -> float:
+        return sum(x1 * y2 - x2 * y1 for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1])) / 2
+
+    @staticmethod
+    def ring_contains(ring: Ring, lon: float, lat: float) -> bool:
+        # Ray casting towards increasing longitude, counting the edges crossed
+        inside = False
+        x1, y1 = ring[-1]
+        for x2, y2 in ring:
+            if (y1 > lat) != (y2 > lat) and lon < x1 + (lat - y1) * (x2 - x1) / (y2 - y1):
+                inside = not inside
+            x1, y1 = x2, y2
+        return inside
+
+    def contains(self, lon: float, lat: float) -> bool:
+        if not (self.min_lon <= lon <= self.max_lon and self.min_lat <= lat <= self.max_lat):
+            return False
+        for outer, holes in self.parts:
+            if BoundaryPolygon.ring_contains(outer, lon, lat) and not any(
+                BoundaryPolygon.ring_contains(hole, lon, lat) for hole in holes
+            ):
+                return True
+        return False
+
+
+class OfflineGeocoder:
+    """
+    Answers reverse geocoding from local boundary polygons instead of Nominatim.
+    The GeoJSON features need a "kind" property of "region" or "city" and a "name" property.
+    A uniform grid maps each cell to the polygons whose bounding box overlaps it, so a lookup only
+    runs the point-in-polygon test on the few polygons near the point.
+    """
+
+    def __init__(self, polygons: list[BoundaryPolygon], cell_degrees: float = GRID_CELL_DEGREES):
+        self.cell_degrees = cell_degrees
+        self.polygons = sorted(polygons, key=lambda polygon: polygon.area)
+        self.grid: dict[tuple[int, int], list[BoundaryPolygon]] = {}
+        for polygon in self.polygons:
+            for lat_cell in range(self.cell(polygon.min_lat), self.cell(polygon.max_lat) + 1):
+                for lon_cell in range(self.cell(polygon.min_lon), self.cell(polygon.max_lon) + 1):
+                    self.grid.setdefault((lat_cell, lon_cell), []).append(polygon)
+
+    def cell(self, degrees: float) -> int:
+        return math.floor(degrees / self.cell_degrees)
+
+    @staticmethod
+    def parse_parts(geometry: dict) -> list[tuple[Ring, list[Ring]]]:
+        if geometry['type'] == 'Polygon':
+            polygons = [geometry['coordinates']]
+        elif geometry['type'] == 'MultiPolygon':
+            polygons = geometry['coordinates']
+        else:
+            return []
+        return [
+            ([(float(lon), float(lat)) for lon, lat, *_ in rings[0]],
+             [[(float(lon), float(lat)) for lon, lat, *_ in hole] for hole in rings[1:]])
+            for rings in polygons if rings and rings[0]
+        ]
+
+    @staticmethod
+    def from_geojson(path: str) -> 'OfflineGeocoder':
+        with open(path, encoding='utf-8') as file:
+            collection = json.load(file)
+
+        polygons = []
+        for feature in collection.get('features', []):
+            properties = feature.get('properties') or {}
+            kind, name = properties.get('kind'), properties.get('name')
+            parts = OfflineGeocoder.parse_parts(feature.get('geometry') or {})
+            if kind in ('region', 'city') and name and parts:
+                polygons.append(BoundaryPolygon(kind, name, parts))
+        return OfflineGeocoder(polygons)
+
+    def locate(self, latitude: float, longitude: float) -> tuple[str, str]:
+        # Same (region, city) contract as the Nominatim lookup, "Unknown" where no polygon matches
+        region = city = None
+        for polygon in self.grid.get((self.cell(latitude), self.cell(longitude)), ()):
+            if (region if polygon.kind == 'region' else city) is not None:
+                continue
+            if polygon.contains(longitude, latitude):
+                if polygon.kind == 'region':
+                    region = polygon.name
+                else:
+                    city = polygon.name
+                if region is not None and city is not None:
+                    break
+        return region or UNKNOWN, city or UNKNOWN
+
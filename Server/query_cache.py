@@ -0,0 +1,64 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Final, Hashable, TypeVar
+
+MAX_CACHE_ENTRIES: Final[int] = 512
+
+T = TypeVar('T')
+
+
+class QueryCache:
+    """
+    Read-through LRU cache for query results, tagged with a per-table data generation.
+    Every write to a table bumps its generation, so entries loaded before the write are never served again
+    and repeated reads between writes do not touch SQLite.
+    """
+
+    def __init__(self, max_entries: int = MAX_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple[str, Hashable], tuple[int, object]] = OrderedDict()
+        self._generations: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def generation(self, table_name: str) -> int:
+        with self._lock:
+            return self._generations.get(table_name, 0)
+
+    def bump(self, table_name: str, *_):
+        # Extra arguments are ignored so this can be registered directly as a change listener
+        with self._lock:
+            self._generations[table_name] = self._generations.get(table_name, 0) + 1
+
+    def get_or_load(self, table_name: str, key: Hashable, loader: Callable[[], T]) -> T:
+        entry_key = (table_name, key)
+        with self._lock:
+            generation = self._generations.get(table_name, 0)
+            entry = self._entries.get(entry_key)
+            if entry is not None and entry[0] == generation:
+                self._entries.move_to_end(entry_key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        value = loader()
+
+        with self._lock:
+            # Tagged with the generation read before loading, a write during the load makes it stale right away
+            self._entries[entry_key] = (generation, value)
+            self._entries.move_to_end(entry_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'generations': dict(self._generations),
+            }
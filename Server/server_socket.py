@@ -1,7 +1,7 @@
 import threading
 from Common.EveMapSocket import EveMapServerSocket, EveMapConnSocket
 from Common.packet_base.eve_packet import MessageType, PacketType
-from eve_map_dal import EveMapDAL
+from Server.eve_map_dal import EveMapDAL
 
 HOST = '0.0.0.0'
 
@@ -33,7 +33,7 @@ def handle_client(conn_socket: EveMapConnSocket):
             conn_socket.handle_user_command(EveMapDAL.get_all_users())
 
         elif message_type == MessageType.FETCH_EVENTS and packet_type == PacketType.REQUEST:
-            conn_socket.handle_event_command(EveMapDAL.fetch_all_coordinates_from_admin_events())
+            conn_socket.handle_event_command(EveMapDAL.iter_event_batches('ADMIN_EVENTS'))
 
         elif message_type == MessageType.INSERT_EVENT and packet_type == PacketType.REQUEST:
             conn_socket.handle_insert_event_command(message)
@@ -41,6 +41,15 @@ def handle_client(conn_socket: EveMapConnSocket):
         elif message_type == MessageType.INSERT_ADMIN_EVENT and packet_type == PacketType.REQUEST:
             conn_socket.handle_insert_admin_event_command(message)
 
+        elif message_type == MessageType.INSERT_EVENTS_BATCH and packet_type == PacketType.REQUEST:
+            conn_socket.handle_insert_events_batch_command(message)
+
+        elif message_type == MessageType.PROMOTE_ADMIN_EVENTS and packet_type == PacketType.REQUEST:
+            conn_socket.handle_promote_admin_events_command(message)
+
+        elif message_type == MessageType.FETCH_ADMIN_CHANGES and packet_type == PacketType.REQUEST:
+            conn_socket.handle_admin_changes_command(message)
+
         elif message_type == MessageType.DELETE_EVENT and packet_type == PacketType.REQUEST:
             conn_socket.handle_delete_event_command(message)
 
@@ -0,0 +1,680 @@
+import json
+import sqlite3
+from datetime import datetime
+from typing import ContextManager, Final, Iterator, Optional
+
+from Server.db_pool import ConnectionPool
+from Server.event import Event, EventBatch, EventChange, Risk
+from Server.expiration import ExpirationEngine
+from Server.query_cache import QueryCache
+from Server.storage_engine import CHANGE_LOG_SIZE, EVENT_TABLES, FETCH_BATCH_SIZE, BoundingBox, StorageEngine
+from Server.user import User
+
+DATABASE_FILENAME: Final[str] = 'evemap.db'
+CHANGE_TRIM_INTERVAL: Final[int] = 1_000  # The change log is trimmed back to CHANGE_LOG_SIZE every this many records
+
+
+class SQLiteStorageEngine(StorageEngine):
+    """
+    Stores everything in a single SQLite file: pooled per-thread connections, an R*Tree per event table
+    for the spatial lookups, trigger-maintained facets and a read-through query cache.
+    """
+
+    def __init__(self, database_filename: str = DATABASE_FILENAME, **kwargs):
+        super().__init__(**kwargs)
+        self.database_filename = database_filename
+        self.pool = ConnectionPool(database_filename)
+        self.expiration_engine = ExpirationEngine(self.pool)
+        self.query_cache = QueryCache()
+
+        # Expired rows change the table just like deletes do
+        self.expiration_engine.add_listener(self.query_cache.bump)
+
+    # --- Schema ---
+
+    @staticmethod
+    def create_events_table(cursor):
+        event_table = """CREATE TABLE IF NOT EXISTS EVENTS (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    event_name TEXT,
+                    longitude REAL,
+                    latitude REAL,
+                    risk INT,
+                    region_id INTEGER REFERENCES REGIONS (id),
+                    city_id INTEGER REFERENCES CITIES (id),
+                    created_at DATETIME
+                ); """
+        cursor.execute(event_table)
+
+    @staticmethod
+    def create_users_table(cursor):
+        user_table = """ CREATE TABLE IF NOT EXISTS USERS (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        name TEXT NOT NULL,
+                        mail_address TEXT UNIQUE,
+                        password_hash TEXT NOT NULL,
+                        home_long REAL,
+                        home_lat REAL
+                    ); """
+        cursor.execute(user_table)
+
+    @staticmethod
+    def create_admin_events_table(cursor):
+        event_table = """ CREATE TABLE IF NOT EXISTS ADMIN_EVENTS (
+                            id INTEGER PRIMARY KEY AUTOINCREMENT,
+                            event_name TEXT,
+                            longitude REAL,
+                            latitude REAL,
+                            risk INT,
+                            region_id INTEGER REFERENCES REGIONS (id),
+                            city_id INTEGER REFERENCES CITIES (id),
+                            created_at DATETIME
+                        ); """
+        cursor.execute(event_table)
+
+    @staticmethod
+    def create_location_tables(cursor):
+        # City and region names are stored once here, event rows only keep the integer ids
+        cursor.execute(
+            """CREATE TABLE IF NOT EXISTS CITIES (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT UNIQUE NOT NULL
+                ); """
+        )
+        cursor.execute(
+            """CREATE TABLE IF NOT EXISTS REGIONS (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT UNIQUE NOT NULL
+                ); """
+        )
+
+    @staticmethod
+    def migrate_location_columns(cursor, table_name: str):
+        # Tables created before the lookup tables store the names as TEXT, rebuild them with ids
+        columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table_name})").fetchall()]
+        if 'city' not in columns:
+            return
+
+        print(f"Migrating {table_name} to city and region ids...")
+        cursor.execute(f"INSERT OR IGNORE INTO CITIES (name) SELECT DISTINCT city FROM {table_name} WHERE city IS NOT NULL")
+        cursor.execute(
+            f"INSERT OR IGNORE INTO REGIONS (name) SELECT DISTINCT region FROM {table_name} WHERE region IS NOT NULL"
+        )
+        sequence = cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table_name,)).fetchone()
+
+        cursor.execute(f"ALTER TABLE {table_name} RENAME TO {table_name}_OLD")
+        if table_name == 'EVENTS':
+            SQLiteStorageEngine.create_events_table(cursor)
+        else:
+            SQLiteStorageEngine.create_admin_events_table(cursor)
+
+        cursor.execute(
+            f"""
+            INSERT INTO {table_name} (id, event_name, longitude, latitude, risk, region_id, city_id, created_at)
+            SELECT e.id, e.event_name, e.longitude, e.latitude, e.risk, r.id, c.id, e.created_at
+            FROM {table_name}_OLD e
+            LEFT JOIN REGIONS r ON r.name = e.region
+            LEFT JOIN CITIES c ON c.name = e.city
+        """
+        )
+        # Dropping the old table also drops its indexes and triggers, they are recreated by create_database
+        cursor.execute(f"DROP TABLE {table_name}_OLD")
+        if sequence is not None:
+            # Keep ids of deleted rows from being handed out again
+            cursor.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?", (sequence[0], table_name))
+
+    @staticmethod
+    def create_facet_tables(cursor):
+        # Per-risk event counts of every city and region in EVENTS, maintained by triggers
+        cursor.execute(
+            """CREATE TABLE IF NOT EXISTS CITY_FACETS (
+                    city_id INTEGER NOT NULL REFERENCES CITIES (id),
+                    risk INT NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (city_id, risk)
+                ); """
+        )
+        cursor.execute(
+            """CREATE TABLE IF NOT EXISTS REGION_FACETS (
+                    region_id INTEGER NOT NULL REFERENCES REGIONS (id),
+                    risk INT NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (region_id, risk)
+                ); """
+        )
+
+        for facet_table, column in (('CITY_FACETS', 'city_id'), ('REGION_FACETS', 'region_id')):
+            increment = f"""
+                INSERT INTO {facet_table} ({column}, risk, count)
+                SELECT NEW.{column}, NEW.risk, 1 WHERE NEW.{column} IS NOT NULL
+                ON CONFLICT ({column}, risk) DO UPDATE SET count = count + 1;
+            """
+            decrement = f"""
+                UPDATE {facet_table} SET count = count - 1 WHERE {column} = OLD.{column} AND risk = OLD.risk;
+            """
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS EVENTS_{facet_table}_INSERT AFTER INSERT ON EVENTS BEGIN {increment} END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS EVENTS_{facet_table}_DELETE AFTER DELETE ON EVENTS BEGIN {decrement} END"
+            )
+            cursor.execute(
+                f"""CREATE TRIGGER IF NOT EXISTS EVENTS_{facet_table}_UPDATE
+                    AFTER UPDATE OF {column}, risk ON EVENTS BEGIN {decrement} {increment} END"""
+            )
+
+            # Recount on startup, so the facets are correct for rows written before the triggers existed
+            cursor.execute(f"DELETE FROM {facet_table}")
+            cursor.execute(
+                f"""INSERT INTO {facet_table} ({column}, risk, count)
+                    SELECT {column}, risk, COUNT(*) FROM EVENTS WHERE {column} IS NOT NULL GROUP BY {column}, risk"""
+            )
+
+    @staticmethod
+    def get_location_id(connection, table_name: str, name: str) -> int:
+        # Id of the city or region name in its lookup table, adding it on first use
+        connection.execute(f"INSERT OR IGNORE INTO {table_name} (name) VALUES (?)", (name,))
+        return connection.execute(f"SELECT id FROM {table_name} WHERE name = ?", (name,)).fetchone()[0]
+
+    @staticmethod
+    def create_spatial_index(cursor, table_name: str):
+        # R*Tree side table holding one point box per event, kept in sync by triggers on the event table
+        cursor.execute(
+            f"""CREATE VIRTUAL TABLE IF NOT EXISTS {table_name}_RTREE
+                USING rtree(id, min_lat, max_lat, min_lon, max_lon)"""
+        )
+        cursor.execute(
+            f"""CREATE TRIGGER IF NOT EXISTS {table_name}_RTREE_INSERT AFTER INSERT ON {table_name}
+                BEGIN
+                    INSERT INTO {table_name}_RTREE VALUES
+                        (NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude);
+                END"""
+        )
+        cursor.execute(
+            f"""CREATE TRIGGER IF NOT EXISTS {table_name}_RTREE_DELETE AFTER DELETE ON {table_name}
+                BEGIN
+                    DELETE FROM {table_name}_RTREE WHERE id = OLD.id;
+                END"""
+        )
+        cursor.execute(
+            f"""CREATE TRIGGER IF NOT EXISTS {table_name}_RTREE_UPDATE
+                AFTER UPDATE OF latitude, longitude ON {table_name}
+                BEGIN
+                    UPDATE {table_name}_RTREE
+                    SET min_lat = NEW.latitude, max_lat = NEW.latitude,
+                        min_lon = NEW.longitude, max_lon = NEW.longitude
+                    WHERE id = NEW.id;
+                END"""
+        )
+
+        # Index rows that were stored before the spatial index existed
+        cursor.execute(
+            f"""INSERT INTO {table_name}_RTREE
+                SELECT id, latitude, latitude, longitude, longitude FROM {table_name}
+                WHERE id NOT IN (SELECT id FROM {table_name}_RTREE)"""
+        )
+
+    @staticmethod
+    def create_change_log(cursor):
+        # Every insert, update and delete on the event tables appends a record, the expiration engine
+        # relabels its deletes as 'expire'. Names are stored as ids and resolved when read
+        cursor.execute(
+            """CREATE TABLE IF NOT EXISTS CHANGES (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    table_name TEXT NOT NULL,
+                    op TEXT NOT NULL,
+                    event_id INTEGER NOT NULL,
+                    event_name TEXT,
+                    longitude REAL,
+                    latitude REAL,
+                    risk INT,
+                    region_id INTEGER,
+                    city_id INTEGER
+                ); """
+        )
+        cursor.execute("CREATE INDEX IF NOT EXISTS IDX_CHANGES_TABLE_SEQ ON CHANGES (table_name, seq)")
+
+        for table_name in EVENT_TABLES:
+            for trigger, op, row in (('INSERT', 'insert', 'NEW'), ('UPDATE', 'update', 'NEW'), ('DELETE', 'delete', 'OLD')):
+                cursor.execute(
+                    f"""CREATE TRIGGER IF NOT EXISTS {table_name}_CHANGES_{trigger} AFTER {trigger} ON {table_name}
+                        BEGIN
+                            INSERT INTO CHANGES
+                                (table_name, op, event_id, event_name, longitude, latitude, risk, region_id, city_id)
+                            VALUES ('{table_name}', '{op}', {row}.id, {row}.event_name, {row}.longitude,
+                                    {row}.latitude, {row}.risk, {row}.region_id, {row}.city_id);
+                        END"""
+                )
+
+        # Keeps the log bounded without a cleanup job, one trim per CHANGE_TRIM_INTERVAL records
+        cursor.execute(
+            f"""CREATE TRIGGER IF NOT EXISTS CHANGES_TRIM AFTER INSERT ON CHANGES
+                WHEN NEW.seq % {CHANGE_TRIM_INTERVAL} = 0
+                BEGIN
+                    DELETE FROM CHANGES WHERE seq <= NEW.seq - {CHANGE_LOG_SIZE};
+                END"""
+        )
+
+    @staticmethod
+    def create_event_indexes(cursor, table_name: str):
+        # Covers the city / region / risk marker filters and the created_at cleanup
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS IDX_{table_name}_CITY_RISK ON {table_name} (city_id, risk)")
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS IDX_{table_name}_REGION_RISK ON {table_name} (region_id, risk)")
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS IDX_{table_name}_RISK_CREATED_AT ON {table_name} (risk, created_at)"
+        )
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS IDX_{table_name}_CREATED_AT ON {table_name} (created_at)")
+
+    def create_database(self):
+        with self.pool.transaction() as connection:
+            cursor = connection.cursor()
+
+            self.create_location_tables(cursor)
+            self.create_events_table(cursor)
+            self.create_users_table(cursor)
+            self.create_admin_events_table(cursor)
+
+            self.migrate_location_columns(cursor, 'EVENTS')
+            self.migrate_location_columns(cursor, 'ADMIN_EVENTS')
+
+            self.create_spatial_index(cursor, 'EVENTS')
+            self.create_spatial_index(cursor, 'ADMIN_EVENTS')
+
+            self.create_event_indexes(cursor, 'EVENTS')
+            self.create_event_indexes(cursor, 'ADMIN_EVENTS')
+
+            self.create_facet_tables(cursor)
+            self.create_change_log(cursor)
+
+        self.optimize_database()
+
+    def optimize_database(self):
+        # Refresh the planner statistics, analysis_limit keeps ANALYZE cheap on large tables
+        connection = self.pool.get_connection()
+        connection.execute("PRAGMA analysis_limit=1000")
+        connection.execute("ANALYZE")
+        connection.execute("PRAGMA optimize")
+
+    # --- Lifecycle and monitoring ---
+
+    def cleanup_database(self) -> int:
+        # Expires everything past its TTL right away, the cleanup thread does the same on its own schedule
+        return self.expiration_engine.expire_all()
+
+    def start_cleanup_thread(self):
+        self.expiration_engine.start()
+
+    def get_data_version(self, table_name: str) -> int:
+        # Changes whenever the table is written to
+        return self.query_cache.generation(table_name)
+
+    def get_stats(self) -> dict:
+        return {
+            'engine': 'sqlite',
+            'cache': self.query_cache.stats(),
+            'expiration': self.expiration_engine.stats(),
+        }
+
+    def transaction(self) -> ContextManager:
+        return self.pool.transaction()
+
+    def mark_changed(self, table_name: str):
+        self.query_cache.bump(table_name)
+
+    # --- Events and admin events ---
+
+    def write_events(
+            self, table_name: str, located_events: list[tuple[Event, Optional[str], Optional[str]]], created_at: datetime
+    ):
+        with self.pool.transaction() as connection:
+            # Pending locations are stored as NULL ids, the marker queries already show them as 'Unknown'
+            location_ids: dict[tuple[Optional[str], Optional[str]], tuple[Optional[int], Optional[int]]] = {
+                (None, None): (None, None)
+            }
+            rows = []
+            for event, region, city in located_events:
+                if (region, city) not in location_ids:
+                    location_ids[(region, city)] = (
+                        self.get_location_id(connection, 'REGIONS', region),
+                        self.get_location_id(connection, 'CITIES', city),
+                    )
+                rows.append(
+                    (event.event_name, event.longitude, event.latitude, event.risk.value,
+                     *location_ids[(region, city)], created_at)
+                )
+            connection.executemany(
+                f"""
+                INSERT INTO {table_name} (event_name, longitude, latitude, risk, region_id, city_id, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+                rows,
+            )
+
+        self.query_cache.bump(table_name)
+        for risk_value in {event.risk.value for event, _, _ in located_events}:
+            self.expiration_engine.schedule(table_name, risk_value, created_at)
+
+    def fetch_pending_locations(self, table_name: str, limit: int, after_id: int = 0) -> list[tuple[int, float, float]]:
+        return self.pool.get_connection().execute(
+            f"SELECT id, latitude, longitude FROM {table_name} WHERE city_id IS NULL AND id > ? ORDER BY id LIMIT ?",
+            (after_id, limit)
+        ).fetchall()
+
+    def update_locations(self, table_name: str, locations: list[tuple[int, str, str]]) -> int:
+        with self.pool.transaction() as connection:
+            location_ids: dict[tuple[str, str], tuple[int, int]] = {}
+            rows = []
+            for db_id, region, city in locations:
+                if (region, city) not in location_ids:
+                    location_ids[(region, city)] = (
+                        self.get_location_id(connection, 'REGIONS', region),
+                        self.get_location_id(connection, 'CITIES', city),
+                    )
+                rows.append((*location_ids[(region, city)], db_id))
+            # The facet triggers count the events once their city and region are known
+            cursor = connection.executemany(
+                f"UPDATE {table_name} SET region_id = ?, city_id = ? WHERE id = ? AND city_id IS NULL", rows
+            )
+
+        self.query_cache.bump(table_name)
+        return cursor.rowcount
+
+    def fetch_rows_cached(self, table_name: str, query: str, params=()) -> tuple:
+        # Serves repeated reads from the query cache until the table is written to again
+        def load():
+            cursor = self.pool.get_connection().cursor()
+            cursor.execute(query, params)
+            return tuple(cursor.fetchall())
+
+        try:
+            return self.query_cache.get_or_load(table_name, (query, tuple(params)), load)
+        except sqlite3.Error as e:
+            print(f"Error fetching events: {e}")
+            return ()  # Return empty result on error
+
+    @staticmethod
+    def build_marker_query(
+            table_name: str, city=None, region=None, risk=None, bounding_box: Optional[BoundingBox] = None
+    ) -> tuple[str, list]:
+        # Modify the query to include the identity field, names are resolved through the lookup tables
+        query = f"""
+            SELECT e.id, e.event_name, e.latitude, e.longitude, e.risk,
+                   COALESCE(c.name, 'Unknown'), COALESCE(r.name, 'Unknown')
+            FROM {table_name} e
+            LEFT JOIN CITIES c ON c.id = e.city_id
+            LEFT JOIN REGIONS r ON r.id = e.region_id
+            WHERE 1=1"""
+        params = []
+
+        # Equality filters compare integer ids, the name lookup runs once per query
+        # Events with a pending location are shown as 'Unknown', so that filter includes them
+        if city:
+            query += " AND (e.city_id = (SELECT id FROM CITIES WHERE name = ?)"
+            query += " OR e.city_id IS NULL)" if city == 'Unknown' else ")"
+            params.append(city)
+
+        if region:
+            query += " AND (e.region_id = (SELECT id FROM REGIONS WHERE name = ?)"
+            query += " OR e.region_id IS NULL)" if region == 'Unknown' else ")"
+            params.append(region)
+
+        # Risk 0 (DANGER) is a valid filter, so only a missing value disables it
+        if risk is not None:
+            query += " AND e.risk = ?"
+            params.append(risk)
+
+        # The R*Tree hands over the ids inside the box, the event rows are then looked up by id
+        if bounding_box is not None:
+            min_lat, max_lat, min_lon, max_lon = bounding_box
+            query += f""" AND e.id IN (
+                SELECT id FROM {table_name}_RTREE
+                WHERE max_lat >= ? AND min_lat <= ? AND max_lon >= ? AND min_lon <= ?)"""
+            params.extend((min_lat, max_lat, min_lon, max_lon))
+
+        return query, params
+
+    def explain_marker_query(
+            self, table_name: str, city=None, region=None, risk=None, bounding_box: Optional[BoundingBox] = None
+    ) -> list[str]:
+        # Returns the EXPLAIN QUERY PLAN details of a filtered marker fetch
+        query, params = self.build_marker_query(table_name, city, region, risk, bounding_box)
+        cursor = self.pool.get_connection().cursor()
+        cursor.execute(f"EXPLAIN QUERY PLAN {query}", params)
+        return [row[3] for row in cursor.fetchall()]
+
+    def fetch_batch(self, query: str, params=()) -> EventBatch:
+        # Straight from the connection, for paged reads that would only flush the query cache
+        try:
+            cursor = self.pool.get_connection().cursor()
+            cursor.execute(query, params)
+            return EventBatch.from_rows(cursor.fetchall())
+        except sqlite3.Error as e:
+            print(f"Error fetching events: {e}")
+            return EventBatch.empty()  # Return an empty batch on error
+
+    def fetch_batch_cached(self, table_name: str, query: str, params=()) -> EventBatch:
+        # The cached batch is shared between callers, its Event views are created fresh on every access
+        def load():
+            cursor = self.pool.get_connection().cursor()
+            cursor.execute(query, params)
+            return EventBatch.from_rows(cursor.fetchall())
+
+        try:
+            return self.query_cache.get_or_load(table_name, ('batch', query, tuple(params)), load)
+        except sqlite3.Error as e:
+            print(f"Error fetching events: {e}")
+            return EventBatch.empty()  # Return an empty batch on error
+
+    def fetch_all_coordinates_from_table(
+            self, table_name: str, city=None, region=None, risk=None, bounding_box: Optional[BoundingBox] = None
+    ) -> EventBatch:
+        query, params = self.build_marker_query(table_name, city, region, risk, bounding_box)
+        return self.fetch_batch_cached(table_name, query, params)
+
+    def iter_event_batches(
+            self,
+            table_name: str,
+            city=None,
+            region=None,
+            risk=None,
+            after_id: int = 0,
+            limit: Optional[int] = None,
+            batch_size: int = FETCH_BATCH_SIZE,
+            bounding_box: Optional[BoundingBox] = None,
+    ) -> Iterator[EventBatch]:
+        # Every batch is its own keyset query (id > last seen id), so no cursor stays open between
+        # batches and memory does not grow with the table. The pages skip the query cache, a long
+        # stream would otherwise fill it with pages nobody asks for twice
+        query, params = self.build_marker_query(table_name, city, region, risk, bounding_box)
+        query += " AND e.id > ? ORDER BY e.id LIMIT ?"
+
+        last_id = after_id
+        remaining = limit
+        while remaining is None or remaining > 0:
+            size = batch_size if remaining is None else min(batch_size, remaining)
+            batch = self.fetch_batch(query, [*params, last_id, size])
+            if len(batch) > 0:
+                yield batch
+
+            if len(batch) < size:
+                return
+            last_id = int(batch.identities[-1])
+            if remaining is not None:
+                remaining -= len(batch)
+
+    def get_filter_facets(self) -> dict[str, list[dict]]:
+        # Read from the trigger-maintained facet tables
+        facets = {}
+        for key, facet_table, lookup_table, column in (
+                ('cities', 'CITY_FACETS', 'CITIES', 'city_id'),
+                ('regions', 'REGION_FACETS', 'REGIONS', 'region_id'),
+        ):
+            rows = self.fetch_rows_cached(
+                'EVENTS',
+                f"""
+                SELECT l.name, f.risk, f.count FROM {facet_table} f JOIN {lookup_table} l ON l.id = f.{column}
+                WHERE f.count > 0 ORDER BY l.name
+            """,
+            )
+
+            by_name: dict[str, dict] = {}
+            for name, risk, count in rows:
+                by_name.setdefault(name, {'name': name, 'counts': {}})['counts'][risk] = count
+            facets[key] = list(by_name.values())
+
+        return facets
+
+    def delete_event_from_table(self, db_id: int, table_name: str) -> bool:
+        try:
+            with self.pool.transaction() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f"DELETE FROM {table_name} WHERE id = ?", (db_id,))
+            if cursor.rowcount > 0:
+                self.query_cache.bump(table_name)
+
+            if cursor.rowcount == 0:
+                print(f"Warning: No event found with id {db_id}. No rows deleted.")
+                return False
+            else:
+                print(f"Successfully deleted event with id {db_id}.")
+                return True
+
+        except sqlite3.Error as e:
+            print(f"Database error occurred: {e}")
+            return False
+
+    def promote_admin_events(self, db_ids: list[int]) -> list[int]:
+        if not db_ids:
+            return []
+
+        # The ids travel as one JSON array parameter, so any number of them fits in the statements
+        ids_json = json.dumps([int(db_id) for db_id in db_ids])
+        created_at = datetime.now()  # The TTL in EVENTS starts at the confirmation
+        with self.pool.transaction() as connection:
+            rows = connection.execute(
+                "SELECT id, risk FROM ADMIN_EVENTS WHERE id IN (SELECT value FROM json_each(?)) ORDER BY id",
+                (ids_json,),
+            ).fetchall()
+            if not rows:
+                return []
+
+            connection.execute(
+                """
+                INSERT INTO EVENTS (event_name, longitude, latitude, risk, region_id, city_id, created_at)
+                SELECT event_name, longitude, latitude, risk, region_id, city_id, ?
+                FROM ADMIN_EVENTS WHERE id IN (SELECT value FROM json_each(?)) ORDER BY id
+            """,
+                (created_at, ids_json),
+            )
+            connection.execute("DELETE FROM ADMIN_EVENTS WHERE id IN (SELECT value FROM json_each(?))", (ids_json,))
+
+        self.query_cache.bump('EVENTS')
+        self.query_cache.bump('ADMIN_EVENTS')
+        for risk_value in {risk for _, risk in rows}:
+            self.expiration_engine.schedule('EVENTS', risk_value, created_at)
+
+        print(f"Promoted {len(rows)} admin events into EVENTS")
+        return [db_id for db_id, _ in rows]
+
+    def fetch_similar_candidates(
+            self, table_name: str, bounding_box: BoundingBox, event_name: str, risk_value: int
+    ) -> list[tuple[float, float]]:
+        min_lat, max_lat, min_lon, max_lon = bounding_box
+        query = f"""
+            SELECT e.latitude, e.longitude
+            FROM {table_name}_RTREE r JOIN {table_name} e ON e.id = r.id
+            WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ?
+              AND e.event_name = ? AND e.risk = ?
+        """
+        cursor = self.pool.get_connection().cursor()
+
+        # Attempt to execute the query and fetch results
+        try:
+            cursor.execute(query, (min_lat, max_lat, min_lon, max_lon, event_name, risk_value))
+            return cursor.fetchall()
+        except sqlite3.Error as e:
+            print(f"Error fetching events: {e}")
+            return []  # Return empty list on error
+
+    # --- Change log ---
+
+    def get_latest_change_seq(self) -> int:
+        return self.pool.get_connection().execute("SELECT COALESCE(MAX(seq), 0) FROM CHANGES").fetchone()[0]
+
+    def get_changes(self, table_name: str, since: int, limit: int) -> Optional[list[EventChange]]:
+        oldest, latest = self.pool.get_connection().execute("SELECT MIN(seq), MAX(seq) FROM CHANGES").fetchone()
+        # A cursor ahead of the log comes from another database, one behind it missed trimmed records
+        if since > (latest or 0) or (oldest is not None and since < oldest - 1):
+            return None
+
+        # Cached like the marker reads, every change bumps the table generation anyway
+        rows = self.fetch_rows_cached(
+            table_name,
+            """
+            SELECT ch.seq, ch.op, ch.event_id, ch.event_name, ch.latitude, ch.longitude, ch.risk,
+                   COALESCE(c.name, 'Unknown'), COALESCE(r.name, 'Unknown')
+            FROM CHANGES ch
+            LEFT JOIN CITIES c ON c.id = ch.city_id
+            LEFT JOIN REGIONS r ON r.id = ch.region_id
+            WHERE ch.table_name = ? AND ch.seq > ?
+            ORDER BY ch.seq LIMIT ?
+        """,
+            (table_name, since, limit),
+        )
+        return [
+            EventChange(seq, op, Event(event_name=name, longitude=longitude, latitude=latitude, risk=Risk(risk),
+                                       region=region, city=city, identity=identity))
+            for seq, op, identity, name, latitude, longitude, risk, city, region in rows
+        ]
+
+    # --- Users ---
+
+    def insert_user(self, user: User) -> bool:
+        # Safely get coordinates
+        longitude, latitude = user.get_longitude_and_latitude()
+        with self.pool.transaction() as conn:
+            conn.execute(
+                '''
+                INSERT INTO USERS (name, mail_address, password_hash, home_long, home_lat)
+                VALUES (?, ?, ?, ?, ?)
+            ''',
+                (user.name, user.mail_address, user.password_hash, longitude, latitude),
+            )
+
+        return True
+
+    def get_user_by_email(self, email: str) -> Optional[User]:
+        cursor = self.pool.get_connection().cursor()
+        cursor.execute(
+            "SELECT name, mail_address, password_hash, home_long, home_lat FROM USERS WHERE mail_address = ?", (email,)
+        )
+        row = cursor.fetchone()
+        if row:
+            name, email, password_hash, long, lat = row
+            return User(
+                name=name,
+                mail_address=email,
+                password=password_hash,
+                password_is_hashed=True,
+                home_address={"longitude": long, "latitude": lat},
+            )
+        return None
+
+    def get_all_users(self) -> list[User]:
+        cursor = self.pool.get_connection().cursor()
+        cursor.execute("SELECT name, mail_address, password_hash, home_long, home_lat FROM USERS")
+        rows = cursor.fetchall()
+
+        users: list[User] = []
+        for row in rows:
+            name, email, password_hash, long, lat = row
+            row_data = {
+                'name': name,
+                'home_address': {"home_long": long, "home_lat": lat},
+                'mail_address': email,
+                'password': password_hash,
+            }
+            e = User.from_dict(row_data)
+            users.append(e)
+
+        return users
@@ -0,0 +1,218 @@
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Server.event import Event, Risk
+from Server.storage_engine import InsertStatus, StorageEngine, create_storage_engine
+from Server.user import User
+
+THROUGHPUT_EVENTS = 2_000
+
+
+def fake_geocoder(event: Event) -> tuple[str, str]:
+    # Deterministic (region, city) by longitude, so the checks never call Nominatim
+    if event.longitude < 35.0:
+        return "Center District", "Tel Aviv"
+    return "Jerusalem District", "Jerusalem"
+
+
+def make_event(name: str, latitude: float, longitude: float, risk: Risk = Risk.GOOD) -> Event:
+    return Event(event_name=name, longitude=longitude, latitude=latitude, risk=risk, region="", city="")
+
+
+def check_engine(engine: StorageEngine) -> list[str]:
+    """
+    Runs the behaviour every storage engine has to share against a fresh engine.
+    Returns the descriptions of the failed checks, empty when the engine conforms.
+    """
+    failures = []
+
+    def expect(condition: bool, description: str):
+        if not condition:
+            failures.append(description)
+
+    engine.create_database()
+
+    # Inserts and duplicate detection
+    expect(engine.insert_event_to_table('EVENTS', make_event("Flood", 32.08, 34.78)), "first insert is stored")
+    expect(not engine.insert_event_to_table('EVENTS', make_event("Flood", 32.0801, 34.7801)),
+           "event within the duplicate distance is rejected")
+    expect(engine.insert_event_to_table('EVENTS', make_event("Flood", 32.0801, 34.7801, Risk.DANGER)),
+           "same spot with another risk is stored")
+    expect(engine.insert_event_to_table('EVENTS', make_event("Flood", 31.77, 35.21)), "far away event is stored")
+    expect(engine.insert_event_to_table('ADMIN_EVENTS', make_event("Flood", 32.08, 34.78)),
+           "tables are independent")
+    expect(not engine.insert_event_to_table('NOT_A_TABLE', make_event("Flood", 30.0, 34.0)),
+           "unknown table is rejected")
+
+    statuses = engine.insert_events_batch('EVENTS', [
+        make_event("Fire", 32.1, 34.8),
+        make_event("Fire", 32.1001, 34.8001),
+        make_event("Flood", 32.08, 34.78),
+        make_event("Fire", 31.78, 35.22, Risk.NEUTRAL),
+    ])
+    expect(statuses == [InsertStatus.INSERTED, InsertStatus.DUPLICATE, InsertStatus.DUPLICATE, InsertStatus.INSERTED],
+           f"batch statuses, got {statuses}")
+
+    # Filtered reads
+    events = list(engine.fetch_all_coordinates_from_table('EVENTS'))
+    expect(len(events) == 5, f"EVENTS holds 5 events, got {len(events)}")
+    expect([event.identity for event in events] == sorted(event.identity for event in events), "events are in id order")
+    expect(len(engine.fetch_all_coordinates_from_table('EVENTS', city="Tel Aviv")) == 3, "city filter")
+    expect(len(engine.fetch_all_coordinates_from_table('EVENTS', region="Jerusalem District")) == 2, "region filter")
+    expect(len(engine.fetch_all_coordinates_from_table('EVENTS', risk=Risk.DANGER.value)) == 1, "risk 0 filter")
+    expect(len(engine.fetch_all_coordinates_from_table('EVENTS', city="Tel Aviv", risk=Risk.GOOD.value)) == 2,
+           "city and risk filter")
+    expect(len(engine.fetch_all_coordinates_from_table('EVENTS', city="Nowhere")) == 0, "unknown city")
+    tel_aviv_box = (32.0, 32.2, 34.7, 34.9)
+    expect(len(engine.fetch_all_coordinates_from_table('EVENTS', bounding_box=tel_aviv_box)) == 3, "bounding box")
+    expect(len(engine.fetch_all_coordinates_from_table('EVENTS', risk=Risk.GOOD.value, bounding_box=tel_aviv_box)) == 2,
+           "bounding box and risk filter")
+    expect(sum(len(batch) for batch in engine.iter_event_batches('EVENTS', batch_size=1, bounding_box=tel_aviv_box)) == 3,
+           "paged bounding box")
+
+    # Keyset pagination
+    pages = list(engine.iter_event_batches('EVENTS', batch_size=2))
+    expect([len(page) for page in pages] == [2, 2, 1], f"pages of 2, got {[len(page) for page in pages]}")
+    after_id = events[1].identity
+    page = [event.identity for batch in engine.iter_event_batches('EVENTS', after_id=after_id, limit=2)
+            for event in batch]
+    expect(page == [event.identity for event in events[2:4]], "after_id and limit select one page")
+
+    # Facets
+    facets = engine.get_filter_facets()
+    cities = {facet['name']: facet['counts'] for facet in facets['cities']}
+    expect(cities == {"Jerusalem": {Risk.GOOD.value: 1, Risk.NEUTRAL.value: 1},
+                      "Tel Aviv": {Risk.GOOD.value: 2, Risk.DANGER.value: 1}}, f"city facets, got {cities}")
+
+    # Deletes and data versions
+    version = engine.get_data_version('EVENTS')
+    expect(engine.delete_event_from_table(events[0].identity, 'EVENTS'), "delete existing event")
+    expect(not engine.delete_event_from_table(events[0].identity, 'EVENTS'), "delete missing event")
+    expect(engine.get_data_version('EVENTS') != version, "writes change the data version")
+    expect(len(engine.fetch_all_coordinates_from_table('EVENTS')) == 4, "deleted event is gone")
+
+    # Promotion keeps the stored location and moves the row
+    admin_ids = [event.identity for event in engine.fetch_all_coordinates_from_table('ADMIN_EVENTS')]
+    expect(engine.promote_admin_events(admin_ids + [10 ** 6]) == admin_ids, "promotion returns the existing ids")
+    expect(len(engine.fetch_all_coordinates_from_table('ADMIN_EVENTS')) == 0, "promoted events leave ADMIN_EVENTS")
+    expect(len(engine.fetch_all_coordinates_from_table('EVENTS', city="Tel Aviv")) == 3,
+           "promoted event keeps its city")
+
+    # Users
+    engine.insert_user(User(name="Alice", mail_address="alice@example.com", password="secret",
+                            home_address={"longitude": 34.78, "latitude": 32.08}))
+    engine.insert_user(User(name="Bob", mail_address="bob@example.com", password="secret",
+                            home_address={"longitude": 35.21, "latitude": 31.77}))
+    alice = engine.get_user_by_email("alice@example.com")
+    expect(alice is not None and alice.check_password("secret"), "user is found by mail address")
+    expect(engine.get_user_by_email("nobody@example.com") is None, "unknown mail address")
+    expect(sorted(user.name for user in engine.get_all_users()) == ["Alice", "Bob"], "all users")
+
+    # Pending locations read as 'Unknown' until they are filled in
+    _, located_events = engine.prepare_events_batch('EVENTS', [make_event("Storm", 33.0, 35.5)], geocode=False)
+    expect([location for _, *location in located_events] == [[None, None]], "deferred geocoding leaves it pending")
+    engine.write_events('EVENTS', located_events, datetime.now())
+    pending = engine.fetch_pending_locations('EVENTS', 10)
+    expect(len(pending) == 1, "pending event is listed")
+    expect(pending and not engine.fetch_pending_locations('EVENTS', 10, pending[0][0]), "pending events are paged by id")
+    expect(len(engine.fetch_all_coordinates_from_table('EVENTS', city="Unknown")) == 1, "pending event reads as Unknown")
+    expect("Unknown" not in {facet['name'] for facet in engine.get_filter_facets()['cities']},
+           "pending events are left out of the facets")
+    if pending:
+        expect(engine.update_locations('EVENTS', [(pending[0][0], "North District", "Safed")]) == 1,
+               "pending location is filled in")
+        expect(engine.update_locations('EVENTS', [(pending[0][0], "North District", "Safed")]) == 0,
+               "located event is not updated again")
+    expect(not engine.fetch_pending_locations('EVENTS', 10), "nothing left pending")
+    expect(len(engine.fetch_all_coordinates_from_table('EVENTS', city="Safed")) == 1, "located event matches its city")
+    expect("Safed" in {facet['name'] for facet in engine.get_filter_facets()['cities']}, "located event is in the facets")
+
+    # Change log, in write order per table
+    latest = engine.get_latest_change_seq()
+    changes = engine.get_changes('EVENTS', 0, 100) or []
+    expect([change.op for change in changes] == ['insert'] * 5 + ['delete', 'insert', 'insert', 'update'],
+           f"EVENTS change ops, got {[change.op for change in changes]}")
+    expect([change.seq for change in changes] == sorted({change.seq for change in changes}), "sequence increases")
+    expect(changes and changes[-1].seq <= latest and changes[-1].event.city == "Safed", "update carries the new city")
+    expect(changes and changes[5].event.identity == events[0].identity, "delete names the deleted event")
+    admin_changes = engine.get_changes('ADMIN_EVENTS', 0, 100) or []
+    expect([change.op for change in admin_changes] == ['insert', 'delete'], "promotion is a delete in ADMIN_EVENTS")
+    expect([change.seq for change in engine.get_changes('EVENTS', changes[-2].seq, 100) or []] == [changes[-1].seq]
+           if changes else False, "since skips older changes")
+    expect(engine.get_changes('EVENTS', changes[1].seq, 2) == changes[2:4] if changes else False, "limit pages")
+    expect(engine.get_changes('EVENTS', latest, 100) == [], "nothing after the latest change")
+    expect(engine.get_changes('EVENTS', latest + 1, 100) is None, "cursor from the future needs a snapshot")
+
+    # Expiry, an event written longer ago than its TTL is removed by the next cleanup
+    _, located_events = engine.prepare_events_batch('ADMIN_EVENTS', [make_event("Heatwave", 29.55, 34.95)])
+    engine.write_events('ADMIN_EVENTS', located_events, datetime.now() - timedelta(days=2))
+    expect(len(engine.fetch_all_coordinates_from_table('ADMIN_EVENTS')) == 1, "event past its TTL is written")
+    expect(engine.cleanup_database() == 1, "cleanup expires the event")
+    expect(len(engine.fetch_all_coordinates_from_table('ADMIN_EVENTS')) == 0, "expired event is gone")
+    expect([change.op for change in engine.get_changes('ADMIN_EVENTS', latest, 100) or []] == ['insert', 'expire'],
+           "expiry is logged as expire")
+
+    return failures
+
+
+def measure_throughput(engine: StorageEngine, count: int = THROUGHPUT_EVENTS) -> dict[str, float]:
+    # Operations per second of the main paths, on random events spread over the country
+    engine.create_database()
+    generator = random.Random(0)
+    events = [
+        make_event(f"Event {index % 20}", generator.uniform(29.5, 33.3), generator.uniform(34.2, 35.9),
+                   Risk(index % 3))
+        for index in range(count)
+    ]
+
+    results = {}
+    start = time.perf_counter()
+    for event in events[:count // 2]:
+        engine.insert_event_to_table('EVENTS', event)
+    results['single inserts/s'] = (count // 2) / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    engine.insert_events_batch('EVENTS', events[count // 2:])
+    results['batch inserts/s'] = (count - count // 2) / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    rows = sum(len(batch) for batch in engine.iter_event_batches('EVENTS'))
+    results['streamed rows/s'] = rows / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for risk in Risk:
+        for city in ("Tel Aviv", "Jerusalem"):
+            engine.fetch_all_coordinates_from_table('EVENTS', city=city, risk=risk.value)
+    results['filtered reads/s'] = 2 * len(Risk) / (time.perf_counter() - start)
+    return results
+
+
+if __name__ == "__main__":
+    # Every engine gets a fresh store, the SQLite one a temporary database file
+    with tempfile.TemporaryDirectory() as directory:
+        engines = {
+            'sqlite': lambda name: create_storage_engine(
+                'sqlite', database_filename=os.path.join(directory, f"{name}.db"), geocoder=fake_geocoder
+            ),
+            'memory': lambda name: create_storage_engine('memory', geocoder=fake_geocoder),
+        }
+
+        all_conform = True
+        for engine_name, create_engine in engines.items():
+            print(f"\n=== {engine_name} ===")
+            failures = check_engine(create_engine('conformance'))
+            all_conform = all_conform and not failures
+            print("Conformance: " + ("OK" if not failures else f"{len(failures)} FAILED"))
+            for failure in failures:
+                print(f"  FAILED: {failure}")
+
+            for operation, rate in measure_throughput(create_engine('throughput')).items():
+                print(f"  {operation:>18}: {rate:,.0f}")
+
+    sys.exit(0 if all_conform else 1)
@@ -0,0 +1,287 @@
+from abc import ABC, abstractmethod
+from datetime import datetime
+from enum import Enum
+from typing import Callable, ContextManager, Final, Iterator, Optional
+
+from Server.event import Event, EventBatch, EventChange
+from Server.geo_batch import GeoBatch
+from Server.geo_utils import GeoUtils
+from Server.user import User
+
+DUPLICATE_DISTANCE_METERS: Final[int] = 100
+FETCH_BATCH_SIZE: Final[int] = 500
+EVENT_TABLES: Final[tuple[str, ...]] = ('EVENTS', 'ADMIN_EVENTS')
+CHANGE_LOG_SIZE: Final[int] = 100_000  # Most recent change records kept, older cursors get a snapshot instead
+
+BoundingBox = tuple[float, float, float, float]  # (min_lat, max_lat, min_lon, max_lon)
+
+
+class InsertStatus(Enum):
+    INSERTED = 'inserted'
+    DUPLICATE = 'duplicate'
+    INVALID = 'invalid'
+
+
+class StorageEngine(ABC):
+    """
+    Storage of events, admin events and users behind EveMapDAL.
+    Engines implement the storage primitives, the duplicate detection and geocoding flow of inserts is shared.
+    """
+
+    def __init__(self, geocoder: Callable[[Event], tuple[str, str]] = GeoUtils.get_location_from_coordinates):
+        # Returns (region, city) of an event, replaceable so engines can be compared without network calls
+        self.geocoder = geocoder
+
+    # --- Lifecycle and monitoring ---
+
+    @abstractmethod
+    def create_database(self):
+        ...
+
+    @abstractmethod
+    def start_cleanup_thread(self):
+        ...
+
+    @abstractmethod
+    def cleanup_database(self) -> int:
+        ...
+
+    @abstractmethod
+    def get_data_version(self, table_name: str) -> int:
+        ...
+
+    @abstractmethod
+    def get_stats(self) -> dict:
+        ...
+
+    @abstractmethod
+    def transaction(self) -> ContextManager:
+        # Groups several writes into one atomic unit, the write methods join it when called inside
+        ...
+
+    @abstractmethod
+    def mark_changed(self, table_name: str):
+        # Announces a committed change to the table to the readers (cache generations, data versions)
+        ...
+
+    # --- Events and admin events ---
+
+    @abstractmethod
+    def write_events(
+            self, table_name: str, located_events: list[tuple[Event, Optional[str], Optional[str]]], created_at: datetime
+    ):
+        # Stores (event, region, city) entries that already passed the duplicate check,
+        # a None region and city leaves the location pending until update_locations fills it in
+        ...
+
+    @abstractmethod
+    def fetch_pending_locations(self, table_name: str, limit: int, after_id: int = 0) -> list[tuple[int, float, float]]:
+        # (id, latitude, longitude) of the events after after_id still waiting for their region and city, by id
+        ...
+
+    @abstractmethod
+    def update_locations(self, table_name: str, locations: list[tuple[int, str, str]]) -> int:
+        # Fills in (id, region, city) of pending events, returns how many were still there to update
+        ...
+
+    @abstractmethod
+    def fetch_similar_candidates(
+            self, table_name: str, bounding_box: BoundingBox, event_name: str, risk_value: int
+    ) -> list[tuple[float, float]]:
+        # (latitude, longitude) of the events with the same name and risk inside the box
+        ...
+
+    @abstractmethod
+    def fetch_all_coordinates_from_table(
+            self, table_name: str, city=None, region=None, risk=None, bounding_box: Optional[BoundingBox] = None
+    ) -> EventBatch:
+        # bounding_box is (min_lat, max_lat, min_lon, max_lon) and is answered through the spatial index
+        ...
+
+    @abstractmethod
+    def iter_event_batches(
+            self,
+            table_name: str,
+            city=None,
+            region=None,
+            risk=None,
+            after_id: int = 0,
+            limit: Optional[int] = None,
+            batch_size: int = FETCH_BATCH_SIZE,
+            bounding_box: Optional[BoundingBox] = None,
+    ) -> Iterator[EventBatch]:
+        # Matching events in id order, at most batch_size per batch, after_id and limit select a single page
+        ...
+
+    @abstractmethod
+    def get_filter_facets(self) -> dict[str, list[dict]]:
+        # {'cities': [{'name': ..., 'counts': {risk: count}}], 'regions': [...]} for the cities and regions in EVENTS
+        ...
+
+    @abstractmethod
+    def delete_event_from_table(self, db_id: int, table_name: str) -> bool:
+        ...
+
+    @abstractmethod
+    def promote_admin_events(self, db_ids: list[int]) -> list[int]:
+        # Moves the admin events into EVENTS with their stored region and city, returns the ids that existed
+        ...
+
+    # --- Change log ---
+
+    @abstractmethod
+    def get_latest_change_seq(self) -> int:
+        # Sequence number of the newest change to any event table, 0 before the first one
+        ...
+
+    @abstractmethod
+    def get_changes(self, table_name: str, since: int, limit: int) -> Optional[list[EventChange]]:
+        # Changes to the table after the since cursor in sequence order, at most limit of them.
+        # None when records after the cursor were already dropped from the log, the caller needs a snapshot
+        ...
+
+    # --- Users ---
+
+    @abstractmethod
+    def insert_user(self, user: User) -> bool:
+        ...
+
+    @abstractmethod
+    def get_user_by_email(self, email: str) -> Optional[User]:
+        ...
+
+    @abstractmethod
+    def get_all_users(self) -> list[User]:
+        ...
+
+    # --- Shared insert flow ---
+
+    @staticmethod
+    def is_valid_table(table_name: str) -> bool:
+        return table_name in EVENT_TABLES
+
+    def similar_event_from_table(self, event_to_check: Event, table_name: str) -> bool:
+        # Only events inside the box around the new event can be closer than the duplicate distance,
+        # so the spatial index narrows the candidates down before any distance is computed
+        bounding_box = GeoUtils.bounding_box(
+            event_to_check.latitude, event_to_check.longitude, DUPLICATE_DISTANCE_METERS
+        )
+        rows = self.fetch_similar_candidates(
+            table_name, bounding_box, event_to_check.event_name, event_to_check.risk.value
+        )
+        if not rows:
+            return False
+
+        # Check every candidate in one pass, they already share the name and risk
+        latitudes, longitudes = zip(*rows)
+        return bool(
+            GeoBatch.within_radius(
+                event_to_check.latitude, event_to_check.longitude, latitudes, longitudes, DUPLICATE_DISTANCE_METERS
+            ).any()
+        )
+
+    def insert_event_to_table(self, table_name: str, event: Event) -> bool:
+        if not self.is_valid_table(table_name):
+            return False
+
+        # The duplicate check is an index lookup, so it runs before the slow reverse geocoding
+        if self.similar_event_from_table(event, table_name):
+            print("There is already a similar event")
+            return False
+
+        region, city = self.geocoder(event)
+
+        if (region, city) == ("Unknown", "Unknown"):
+            print(f"Warning: Could not fetch location info for event {event.event_name}")
+
+        print(
+            f"Inserting event: "
+            f"{event.event_name}, {event.longitude}, {event.latitude}, {event.risk}, {region}, {city}"
+        )
+
+        self.write_events(table_name, [(event, region, city)], datetime.now())
+        return True
+
+    def insert_events_batch(self, table_name: str, events: list[Event]) -> list[InsertStatus]:
+        statuses, located_events = self.prepare_events_batch(table_name, events)
+        if located_events:
+            self.write_events(table_name, located_events, datetime.now())
+        return statuses
+
+    def prepare_events_batch(
+            self, table_name: str, events: list[Event], geocode: bool = True
+    ) -> tuple[list[InsertStatus], list[tuple[Event, Optional[str], Optional[str]]]]:
+        # Duplicate checks and geocoding of a batch, without writing, returns the statuses and the events to store.
+        # Without geocode the events are stored with a pending location
+        if not self.is_valid_table(table_name):
+            return [InsertStatus.INVALID] * len(events), []
+
+        statuses = [InsertStatus.INSERTED] * len(events)
+
+        # Only events sharing the name and risk can be duplicates, so each group is checked on its own:
+        # first against the earlier events of the batch, then against the table in a single query
+        groups: dict[tuple[str, int], list[int]] = {}
+        for index, event in enumerate(events):
+            groups.setdefault((event.event_name, event.risk.value), []).append(index)
+
+        for (event_name, risk_value), indexes in groups.items():
+            latitudes = [events[index].latitude for index in indexes]
+            longitudes = [events[index].longitude for index in indexes]
+
+            in_batch_distances = GeoBatch.pairwise_distances(latitudes, longitudes, latitudes, longitudes)
+            kept: list[int] = []
+            for position in range(len(indexes)):
+                if kept and (in_batch_distances[position, kept] < DUPLICATE_DISTANCE_METERS).any():
+                    statuses[indexes[position]] = InsertStatus.DUPLICATE
+                else:
+                    kept.append(position)
+
+            boxes = [GeoUtils.bounding_box(latitudes[i], longitudes[i], DUPLICATE_DISTANCE_METERS) for i in kept]
+            group_box = (
+                min(box[0] for box in boxes),
+                max(box[1] for box in boxes),
+                min(box[2] for box in boxes),
+                max(box[3] for box in boxes),
+            )
+            candidates = self.fetch_similar_candidates(table_name, group_box, event_name, risk_value)
+            if not candidates:
+                continue
+
+            candidate_latitudes, candidate_longitudes = zip(*candidates)
+            # An event is a duplicate when its nearest stored candidate is closer than the duplicate distance
+            _, nearest_distances = GeoBatch.nearest_neighbours(
+                [latitudes[i] for i in kept], [longitudes[i] for i in kept], candidate_latitudes, candidate_longitudes
+            )
+            for position, is_duplicate in zip(kept, nearest_distances[:, 0] < DUPLICATE_DISTANCE_METERS):
+                if is_duplicate:
+                    statuses[indexes[position]] = InsertStatus.DUPLICATE
+
+        to_insert = [event for event, status in zip(events, statuses) if status == InsertStatus.INSERTED]
+        if not to_insert:
+            return statuses, []
+        if not geocode:
+            return statuses, [(event, None, None) for event in to_insert]
+
+        # Reports from the same spot share one reverse geocoding call
+        locations: dict[tuple[float, float], tuple[str, str]] = {}
+        for event in to_insert:
+            coordinates = (event.latitude, event.longitude)
+            if coordinates not in locations:
+                locations[coordinates] = self.geocoder(event)
+
+        print(
+            f"Prepared {len(to_insert)} of {len(events)} events for {table_name} "
+            f"({len(locations)} locations geocoded)"
+        )
+        return statuses, [(event, *locations[(event.latitude, event.longitude)]) for event in to_insert]
+
+
+def create_storage_engine(name: str, **kwargs) -> StorageEngine:
+    # Imported here because both implementations import this module
+    if name == 'sqlite':
+        from Server.sqlite_storage import SQLiteStorageEngine
+        return SQLiteStorageEngine(**kwargs)
+    if name == 'memory':
+        from Server.memory_storage import MemoryStorageEngine
+        return MemoryStorageEngine(**kwargs)
+    raise ValueError(f"Unknown storage engine: {name}")
@@ -0,0 +1,82 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Final, Optional
+
+from Server.cluster_index import ClusterIndex
+from Server.event import Event
+
+MAX_TILE_ZOOM: Final[int] = 20
+MAX_CACHED_TILES: Final[int] = 10_000
+
+
+class TileCache:
+    """
+    JSON bodies of map tiles from the cluster index, kept until an event inside the tile is inserted,
+    updated, deleted or expired. The index reports each event it applies, which drops the one tile
+    holding it on every zoom level, so everything else stays cached.
+    The ETag is a hash of the body, so a tile that is rebuilt unchanged still revalidates.
+    """
+
+    def __init__(self, cluster_index: ClusterIndex, max_tiles: int = MAX_CACHED_TILES):
+        self.cluster_index = cluster_index
+        self.max_tiles = max_tiles
+        self._tiles: OrderedDict[tuple[int, int, int], tuple[str, str]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._epoch = 0  # Counts invalidations, a tile built across one is not cached
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+        cluster_index.add_listener(self.invalidate)
+
+    def invalidate(self, event: Optional[Event]):
+        # Drops the tiles holding the event, every tile when the index was rebuilt
+        with self._lock:
+            self._epoch += 1
+            if event is None:
+                self.invalidations += len(self._tiles)
+                self._tiles.clear()
+                return
+            for zoom in range(MAX_TILE_ZOOM + 1):
+                x, y = ClusterIndex.cell_of(event.latitude, event.longitude, zoom)
+                if self._tiles.pop((zoom, x, y), None) is not None:
+                    self.invalidations += 1
+
+    def get(self, zoom: int, x: int, y: int) -> tuple[str, str]:
+        # Returns (etag, body) of the tile
+        # Applies pending changes first, so their invalidations happen before the cache is read
+        self.cluster_index.sync()
+        key = (zoom, x, y)
+        with self._lock:
+            entry = self._tiles.get(key)
+            if entry is not None:
+                self._tiles.move_to_end(key)
+                self.hits += 1
+                return entry
+            epoch = self._epoch
+
+        # Built outside the lock, two requests for the same new tile may both build it
+        body = json.dumps({"zoom": zoom, "x": x, "y": y, **self.cluster_index.tile(zoom, x, y)})
+        entry = (hashlib.blake2b(body.encode(), digest_size=8).hexdigest(), body)
+        with self._lock:
+            self.misses += 1
+            if epoch != self._epoch:
+                return entry
+            self._tiles[key] = entry
+            while len(self._tiles) > self.max_tiles:
+                self._tiles.popitem(last=False)
+        return entry
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'tiles': len(self._tiles),
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
@@ -1,6 +1,6 @@
 import hashlib
 
-from geopy.geocoders import Nominatim
+from Server.geo_utils import GeoUtils
 
 
 class User:
@@ -70,12 +70,7 @@ class User:
 
     def get_coordinates_from_address(self, address: dict):
         # Get latitude and longitude from the address.
-        geolocator = Nominatim(user_agent="my_geopy_app")
-        location = geolocator.geocode(f"{address['street']}, {address['city']}, {address['state']}")
-        if location:
-            return location.latitude, location.longitude
-        else:
-            return None, None
+        return GeoUtils.get_coordinates_from_address(address['street'], address['city'], address['state'])
 
     def get_longitude_and_latitude(self):
         longitude = self.home_address.get("longitude")
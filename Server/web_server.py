@@ -1,22 +1,29 @@
 import json
+import math
 import secrets
 import socket
 from threading import Thread
 from typing import Final
 
-import folium
-from eve_map_dal import EveMapDAL
-from event import Event, Risk
-from flask import Flask, flash, redirect, render_template, request, url_for
+from Server.eve_map_dal import EveMapDAL, InsertStatus
+from Server.event import Event, Risk
+from Server.geo_utils import GeoUtils
+from Server.change_feed import CHANGES_PAGE_SIZE, change_feed_json
+from Server.http_responses import TILE_CACHE_CONTROL, cached_response, data_etag, not_modified
+from Server.marker_broadcaster import MarkerFilter
+from Server.tile_cache import MAX_TILE_ZOOM
+from flask import Flask, Response, flash, redirect, render_template, request, url_for
 from flask_login import LoginManager, login_required, login_user, logout_user
-from user import User
-from server_socket import start_server_socket_loop
+from Server.user import User
+from Server.server_socket import start_server_socket_loop
 
 HOST_IP: Final[str] = '0.0.0.0'
 HOST_SOCKET_PORT: Final[int] = 6000
 HOST_FLASK_PORT: Final[int] = 5000
 
+EveMapDAL.create_database()
 EveMapDAL.start_cleanup_thread()
+EveMapDAL.start_location_enricher()
 
 app = Flask(__name__)
 
@@ -26,28 +33,6 @@ login_manager.login_view = "login"
 login_manager.init_app(app)
 
 
-def add_all_markers_to_ui(events: list[Event], m):
-    for event in events:
-        print(
-            f"Adding marker: {event.event_name}, Lat: {event.latitude}, Long: {event.longitude}, Risk: {event.risk}"
-        )  # Debugging
-        if event.risk == 0:
-            icon_color = 'red'
-        elif event.risk == 1:
-            icon_color = 'green'
-        elif event.risk == 2:
-            icon_color = 'blue'
-        else:
-            icon_color = 'black'
-            print("Event with a risk error")
-
-        folium.Marker(
-            location=[event.latitude, event.longitude],
-            popup=event.event_name,
-            icon=folium.Icon(color=icon_color, icon="info-sign"),
-        ).add_to(m)
-
-
 def send_marker(event_json: dict):
     event = Event.from_dict(event_json)
     event.print_event()
@@ -110,11 +95,8 @@ def signup():
             return render_template("signup_error.html", email=email)
 
         # If new user, proceed to create
-        from geopy.geocoders import Nominatim
-
-        geolocator = Nominatim(user_agent="signup_app")
-        location = geolocator.geocode(f"{street}, {city}, {state}, Israel")
-        if location is None:
+        latitude, longitude = GeoUtils.get_coordinates_from_address(street, city, state)
+        if latitude is None:
             flash("Could not find the location. Please enter a valid address.")
             return redirect(url_for("signup"))
 
@@ -122,7 +104,7 @@ def signup():
             name=name,
             mail_address=email,
             password=password,
-            home_address={"longitude": location.longitude, "latitude": location.latitude},
+            home_address={"longitude": longitude, "latitude": latitude},
         )
 
         EveMapDAL.insert_user(user)
@@ -132,14 +114,147 @@ def signup():
     return render_template("signup.html")
 
 
+def stream_json_array(batches):
+    # Writes the array one batch at a time, so the full list never sits in memory
+    yield "["
+    separator = ""
+    for batch in batches:
+        yield separator + ", ".join(batch.json_records())
+        separator = ", "
+    yield "]"
+
+
+def stream_ndjson(batches):
+    for batch in batches:
+        yield "".join(record + "\n" for record in batch.json_records())
+
+
+def parse_bounding_box(value: str) -> tuple[float, float, float, float]:
+    # "minLon,minLat,maxLon,maxLat" (the Leaflet toBBoxString order) into (min_lat, max_lat, min_lon, max_lon)
+    min_lon, min_lat, max_lon, max_lat = (float(part) for part in value.split(","))
+    # float() also accepts "nan" and "inf", which would match nothing or everything
+    if not all(math.isfinite(part) for part in (min_lon, min_lat, max_lon, max_lat)):
+        raise ValueError("bbox values must be finite")
+    if min_lat < -90.0 or max_lat > 90.0:
+        raise ValueError("bbox latitudes must be within [-90, 90]")
+    if min_lat > max_lat or min_lon > max_lon:
+        raise ValueError("bbox minimum is above its maximum")
+    return min_lat, max_lat, min_lon, max_lon
+
+
 @app.route("/api/all_markers")
-def get_all_markers() -> list[dict]:
+def get_all_markers() -> Response:
     city = request.args.get("city")
     region = request.args.get("region")
     risk = request.args.get("risk", type=int)
+    # Keyset pagination: the next page starts after the identity of the last marker received
+    after_id = request.args.get("after_id", default=0, type=int)
+    limit = request.args.get("limit", type=int)
+    if "limit" in request.args and (limit is None or limit < 1):
+        return {"error": "limit must be a positive integer"}, 400
+
+    # Read before the query, a write landing in between only makes the next poll fetch again
+    etag = data_etag(EveMapDAL.get_data_version('EVENTS'))
+
+    # Viewport queries: either bbox=minLon,minLat,maxLon,maxLat or lat, lon and radius in meters
+    latitude = request.args.get("lat", type=float)
+    longitude = request.args.get("lon", type=float)
+    radius = request.args.get("radius", type=float)
+    if radius is not None:
+        if (latitude is None or longitude is None or not all(math.isfinite(v) for v in (latitude, longitude, radius))
+                or not -90.0 <= latitude <= 90.0 or radius <= 0):
+            return {"error": "radius needs lat, lon and a positive radius in meters"}, 400
+        unchanged = not_modified(etag)
+        if unchanged is not None:
+            return unchanged
+        batches = EveMapDAL.iter_event_batches_within_radius(
+            'EVENTS', latitude, longitude, radius, city=city, region=region, risk=risk, after_id=after_id, limit=limit
+        )
+    else:
+        try:
+            bounding_box = parse_bounding_box(request.args["bbox"]) if request.args.get("bbox") else None
+        except ValueError:
+            return {"error": "bbox must be minLon,minLat,maxLon,maxLat"}, 400
+        unchanged = not_modified(etag)
+        if unchanged is not None:
+            return unchanged
+        batches = EveMapDAL.iter_event_batches(
+            'EVENTS', city=city, region=region, risk=risk, after_id=after_id, limit=limit, bounding_box=bounding_box
+        )
 
-    all_markers = EveMapDAL.fetch_all_coordinates_from_events(city=city, region=region, risk=risk)
-    return [m.to_dict() for m in all_markers]
+    if request.args.get("format") == "ndjson" or "application/x-ndjson" in request.headers.get("Accept", ""):
+        return cached_response(stream_ndjson(batches), "application/x-ndjson", etag)
+    return cached_response(stream_json_array(batches), "application/json", etag)
+
+
+@app.route("/api/markers/changes")
+def get_marker_changes() -> Response:
+    # Delta sync: since is the cursor of the previous reply, 0 (or a cursor older than the log) gets a snapshot
+    since = request.args.get("since", default=0, type=int)
+    limit = min(max(request.args.get("limit", default=CHANGES_PAGE_SIZE, type=int), 1), CHANGES_PAGE_SIZE)
+
+    etag = data_etag(EveMapDAL.get_data_version('EVENTS'))
+    unchanged = not_modified(etag)
+    if unchanged is not None:
+        return unchanged
+    return cached_response(change_feed_json('EVENTS', since, limit), "application/json", etag)
+
+
+@app.route("/api/markers/clusters")
+def get_marker_clusters() -> Response:
+    # Cluster centroids with counts per risk for a map at zoom, bbox as in /api/all_markers
+    zoom = request.args.get("zoom", type=int)
+    if zoom is None:
+        return {"error": "zoom is required"}, 400
+    try:
+        bounding_box = parse_bounding_box(request.args["bbox"]) if request.args.get("bbox") else None
+    except ValueError:
+        return {"error": "bbox must be minLon,minLat,maxLon,maxLat"}, 400
+
+    etag = data_etag(EveMapDAL.get_data_version('EVENTS'))
+    unchanged = not_modified(etag)
+    if unchanged is not None:
+        return unchanged
+    clusters = EveMapDAL.get_marker_clusters(zoom, bounding_box)
+    return cached_response([json.dumps({"zoom": zoom, **clusters})], "application/json", etag)
+
+
+@app.route("/tiles/<int:z>/<int:x>/<int:y>.json")
+def get_marker_tile(z: int, x: int, y: int) -> Response:
+    # Clusters and events of one slippy-map tile, panning only fetches the tiles not seen yet
+    if not (0 <= z <= MAX_TILE_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return {"error": f"no tile {z}/{x}/{y}"}, 404
+
+    etag, body = EveMapDAL.get_marker_tile(z, x, y)
+    unchanged = not_modified(etag, TILE_CACHE_CONTROL)
+    if unchanged is not None:
+        return unchanged
+    return cached_response([body], "application/json", etag, TILE_CACHE_CONTROL)
+
+
+@app.route("/api/markers/stream")
+def stream_marker_changes() -> Response:
+    # Live inserts and deletes as Server-Sent Events, filtered like /api/all_markers
+    try:
+        bounding_box = parse_bounding_box(request.args["bbox"]) if request.args.get("bbox") else None
+    except ValueError:
+        return {"error": "bbox must be minLon,minLat,maxLon,maxLat"}, 400
+    marker_filter = MarkerFilter(
+        city=request.args.get("city") or None,
+        region=request.args.get("region") or None,
+        risk=request.args.get("risk", type=int),
+        bounding_box=bounding_box,
+    )
+    # Sent by the browser when it reconnects, the missed changes are replayed from the change log.
+    # A page opening a new stream passes the last id it saw as last_event_id, EventSource cannot set headers
+    last_seq = request.headers.get("Last-Event-ID", type=int)
+    if last_seq is None:
+        last_seq = request.args.get("last_event_id", type=int)
+
+    response = Response(EveMapDAL.stream_marker_changes(marker_filter, last_seq), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"  # Keeps nginx from buffering the stream
+    return response
 
 
 @app.route("/api/get_marker", methods=['POST'])
@@ -148,18 +263,51 @@ def get_marker():
     return send_marker(event_json)
 
 
+@app.route("/api/markers/batch", methods=['POST'])
+def send_markers_batch():
+    event_list_json = request.json
+    if not isinstance(event_list_json, list):
+        return {"error": "expected a JSON list of events"}, 400
+
+    results = [InsertStatus.INVALID.value] * len(event_list_json)
+    # Same routing as send_marker: dangerous events wait for verification in ADMIN_EVENTS
+    positions_by_table: dict[str, list[int]] = {'EVENTS': [], 'ADMIN_EVENTS': []}
+    events_by_table: dict[str, list[Event]] = {'EVENTS': [], 'ADMIN_EVENTS': []}
+
+    for position, event_json in enumerate(event_list_json):
+        try:
+            event = Event.from_dict(event_json)
+        except (KeyError, TypeError, ValueError) as ex:
+            print(f"Skipping invalid event in batch: {ex}")
+            continue
+
+        table_name = 'ADMIN_EVENTS' if event.risk == Risk.DANGER else 'EVENTS'
+        positions_by_table[table_name].append(position)
+        events_by_table[table_name].append(event)
+
+    for table_name, events in events_by_table.items():
+        if not events:
+            continue
+        try:
+            statuses = EveMapDAL.insert_events_batch(table_name, events)
+        except Exception as ex:
+            print(f"Error inserting data: {ex}")
+            continue
+
+        for position, status in zip(positions_by_table[table_name], statuses):
+            results[position] = status.value
+
+    return {"results": results}
+
+
 @app.route("/")
 @login_required
 def map_with_markers():
-    m = folium.Map(location=[32.0, 35.0], zoom_start=8)
-    events = EveMapDAL.fetch_all_coordinates_from_events()
-    add_all_markers_to_ui(events, m)
-    map_html = m._repr_html_()
-
+    # The page is a static shell, its markers are loaded from the tile and marker APIs
     cities = EveMapDAL.get_unique_cities()
     regions = EveMapDAL.get_unique_regions()
 
-    return render_template("map_view.html", map_html=map_html, cities=cities, regions=regions)
+    return render_template("map_view.html", cities=cities, regions=regions)
 
 
 @app.route("/submit")
@@ -167,11 +315,25 @@ def submit_event():
     return render_template("submit_event.html")
 
 
+@app.route("/api/stats")
+def get_stats():
+    return EveMapDAL.get_stats()
+
+
 @app.route("/api/filters")
 def get_filter_options():
-    cities = EveMapDAL.get_unique_cities()
-    regions = EveMapDAL.get_unique_regions()
-    return {"cities": cities, "regions": regions}
+    # The facets are counted over EVENTS only
+    etag = data_etag(EveMapDAL.get_data_version('EVENTS'))
+    unchanged = not_modified(etag)
+    if unchanged is not None:
+        return unchanged
+
+    facets = EveMapDAL.get_filter_facets()
+    cities = [facet["name"] for facet in facets["cities"]]
+    regions = [facet["name"] for facet in facets["regions"]]
+    return cached_response(
+        [json.dumps({"cities": cities, "regions": regions, "facets": facets})], "application/json", etag
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,212 @@
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Final, Optional
+
+from Server.event import Event
+from Server.storage_engine import InsertStatus, StorageEngine
+
+MAX_PENDING_WRITES: Final[int] = 10_000  # Submitting blocks once this many writes wait for the writer
+ENQUEUE_TIMEOUT_SECONDS: Final[float] = 5.0
+FLUSH_INTERVAL_SECONDS: Final[float] = 0.05  # Longest a write waits for others to share its transaction
+MAX_FLUSH_SIZE: Final[int] = 500
+FLUSH_HISTORY_SIZE: Final[int] = 100
+
+
+@dataclass(slots=True)
+class PendingWrite:
+    kind: str  # 'insert', 'delete', 'promote' or 'locate'
+    table_name: str
+    events: Optional[list[Event]]
+    db_ids: Optional[list[int]]
+    locations: Optional[list[tuple[int, str, str]]]
+    future: Future
+    submitted_at: float
+
+
+class WriteQueue:
+    """
+    Funnels every event insert and delete through one writer thread.
+    Writes are collected for up to FLUSH_INTERVAL_SECONDS or MAX_FLUSH_SIZE entries and committed in a
+    single transaction, so the web and socket threads never compete for the database write lock.
+    Callers get a Future that resolves once their write is committed.
+    With defer_geocoding inserts are stored with a pending location, the listeners hear about those tables
+    after the commit so the location enricher can fill them in.
+    """
+
+    def __init__(self, engine: StorageEngine, max_pending: int = MAX_PENDING_WRITES, defer_geocoding: bool = False):
+        self.engine = engine
+        self.defer_geocoding = defer_geocoding
+        self._queue: queue.Queue[PendingWrite] = queue.Queue(maxsize=max_pending)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._listeners: list[Callable[[str], None]] = []
+
+        self.flushes = 0
+        self.writes_flushed = 0
+        self.failed_flushes = 0
+        self.failed_writes = 0
+        self.flush_history: deque[dict] = deque(maxlen=FLUSH_HISTORY_SIZE)
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def add_listener(self, listener: Callable[[str], None]):
+        # Called with the table name after every flush that stored events with a pending location
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def _submit(self, kind: str, table_name: str, events: Optional[list[Event]] = None,
+                db_ids: Optional[list[int]] = None, locations: Optional[list[tuple[int, str, str]]] = None) -> Future:
+        self.start()
+        future = Future()
+        # Raises queue.Full when the writer is too far behind, rather than letting callers pile up forever
+        self._queue.put(
+            PendingWrite(kind, table_name, events, db_ids, locations, future, time.monotonic()),
+            timeout=ENQUEUE_TIMEOUT_SECONDS,
+        )
+        return future
+
+    def insert_events(self, table_name: str, events: list[Event]) -> Future:
+        # Resolves to one InsertStatus per event
+        return self._submit('insert', table_name, events=events)
+
+    def delete_event(self, table_name: str, db_id: int) -> Future:
+        # Resolves to True when the event existed
+        return self._submit('delete', table_name, db_ids=[db_id])
+
+    def promote_admin_events(self, db_ids: list[int]) -> Future:
+        # Resolves to the admin event ids that were moved into EVENTS
+        return self._submit('promote', 'ADMIN_EVENTS', db_ids=db_ids)
+
+    def update_locations(self, table_name: str, locations: list[tuple[int, str, str]]) -> Future:
+        # Resolves to the number of pending events that got their (id, region, city) filled in
+        return self._submit('locate', table_name, locations=locations)
+
+    def backlog(self) -> int:
+        return self._queue.qsize()
+
+    def _collect(self) -> list[PendingWrite]:
+        # Blocks for the first write, then gathers whatever arrives within the flush window
+        writes = [self._queue.get()]
+        deadline = time.monotonic() + FLUSH_INTERVAL_SECONDS
+        while len(writes) < MAX_FLUSH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                writes.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return writes
+
+    def _run(self):
+        while True:
+            writes = self._collect()
+            try:
+                self._flush(writes)
+            except Exception as e:
+                self.failed_flushes += 1
+                print(f"Error flushing {len(writes)} writes: {e}")
+                for write in writes:
+                    if not write.future.done():
+                        write.future.set_exception(e)
+
+    def _prepare(self, table_name: str, table_writes: list[PendingWrite]) -> tuple:
+        events = [event for write in table_writes for event in write.events]
+        statuses, located_events = self.engine.prepare_events_batch(
+            table_name, events, geocode=not self.defer_geocoding
+        )
+        return table_name, table_writes, statuses, located_events
+
+    def _flush(self, writes: list[PendingWrite]):
+        flush_start = time.perf_counter()
+
+        # The duplicate checks and geocoding run before the transaction, so the write lock is only held
+        # for the writes themselves. They see the tables as of the start of the flush.
+        inserts_by_table: dict[str, list[PendingWrite]] = {}
+        for write in writes:
+            if write.kind == 'insert':
+                inserts_by_table.setdefault(write.table_name, []).append(write)
+
+        prepared = []
+        for table_name, table_writes in inserts_by_table.items():
+            try:
+                prepared.append(self._prepare(table_name, table_writes))
+            except Exception as e:
+                # Prepared again write by write, so only the writes that fail on their own are failed
+                # and the rest of the window still commits
+                print(f"Error preparing {len(table_writes)} inserts into {table_name}, retrying one by one: {e}")
+                for write in table_writes:
+                    try:
+                        prepared.append(self._prepare(table_name, [write]))
+                    except Exception as write_error:
+                        self.failed_writes += 1
+                        write.future.set_exception(write_error)
+
+        created_at = datetime.now()
+        id_results = []
+        with self.engine.transaction():
+            for table_name, _, _, located_events in prepared:
+                if located_events:
+                    self.engine.write_events(table_name, located_events, created_at)
+            for write in writes:
+                if write.kind == 'delete':
+                    id_results.append((write, self.engine.delete_event_from_table(write.db_ids[0], write.table_name)))
+                elif write.kind == 'promote':
+                    id_results.append((write, self.engine.promote_admin_events(write.db_ids)))
+                elif write.kind == 'locate':
+                    id_results.append((write, self.engine.update_locations(write.table_name, write.locations)))
+
+        # Readers are told about the change only after the commit
+        changed_tables = {write.table_name for write in writes if self.engine.is_valid_table(write.table_name)}
+        if any(write.kind == 'promote' for write in writes):
+            changed_tables.add('EVENTS')
+        for table_name in changed_tables:
+            self.engine.mark_changed(table_name)
+
+        for _, table_writes, statuses, _ in prepared:
+            position = 0
+            for write in table_writes:
+                write.future.set_result(statuses[position:position + len(write.events)])
+                position += len(write.events)
+        for write, result in id_results:
+            write.future.set_result(result)
+
+        if self.defer_geocoding:
+            for table_name, _, _, located_events in prepared:
+                if located_events:
+                    for listener in self._listeners:
+                        listener(table_name)
+
+        self.flushes += 1
+        self.writes_flushed += len(writes)
+        now = time.monotonic()
+        self.flush_history.append(
+            {
+                'writes': len(writes),
+                'inserted': sum(status == InsertStatus.INSERTED for _, _, statuses, _ in prepared for status in statuses),
+                'seconds': time.perf_counter() - flush_start,
+                'max_wait_seconds': max(now - write.submitted_at for write in writes),
+            }
+        )
+
+    def stats(self) -> dict:
+        history = list(self.flush_history)
+        return {
+            'backlog': self.backlog(),
+            'capacity': self._queue.maxsize,
+            'flushes': self.flushes,
+            'writes_flushed': self.writes_flushed,
+            'failed_flushes': self.failed_flushes,
+            'failed_writes': self.failed_writes,
+            'average_flush_size': self.writes_flushed / self.flushes if self.flushes else 0.0,
+            'recent_flushes': history[-10:],
+        }